@@ -66,6 +66,21 @@ EOF
 return
 endfunction
 
+function tex_nine#BackwardSearch(page, ...)
+    " The position on the page is given in big points from the top left
+    " corner
+    let x = a:0 > 0 ? a:1 : 0
+    let y = a:0 > 1 ? a:2 : 0
+python << EOF
+try:
+    document.backward_search(vim.current.buffer, int(vim.eval('a:page')),
+                             float(vim.eval('x')), float(vim.eval('y')))
+except TeXNineError, e:
+    echoerr(e)
+EOF
+return ''
+endfunction
+
 
 "***********************************************************************
 " Miscellaneous (Omni completion, snippets, headers, bibqueries)
@@ -89,7 +104,7 @@ function tex_nine#OmniCompletion(findstart, base)
         let pos = pyeval('omni.findstart()')
         return pos
     else
-        let compl = pyeval('omni.completions()')
+        let compl = pyeval('omni.completions(vim.eval("a:base"))')
         return compl
     endif
 endfunction
@@ -104,14 +119,7 @@ function tex_nine#MathCompletion(findstart, base)
         endwhile
         return start
     else
-        let compl = pyeval('tex_nine_maths_cache')
-        call filter(compl, 'v:val.word =~ "^'.a:base.'"')
-        "let res = []
-        "for m in compl
-        "    if m.word =~ '^'.a:base
-        "        call add(res, m)
-        "    endif
-        "endfor
+        let compl = pyeval('get_maths_index().complete(vim.eval("a:base"), config["fuzzy"])')
         return compl
     endif
 endfunction
@@ -126,6 +134,51 @@ EOF
 return
 endfunction
 
+function tex_nine#CacheInfo()
+python << EOF
+echomsg("Caches in `{0}':".format(cache_dir()))
+for name, size in cache_info():
+    echomsg("  {0} ({1} kB)".format(name, size/1024))
+for fname, n in omni.bibindex().info():
+    echomsg("  BibTeX: {0} ({1} entries)".format(fname, n))
+EOF
+return
+endfunction
+
+function tex_nine#StartupTimes()
+python << EOF
+echomsg("Startup times:")
+for step, ms in startup_times:
+    echomsg("  {0:7.1f} ms  {1}".format(ms, step))
+EOF
+return
+endfunction
+
+function tex_nine#SyncTeXStats()
+python << EOF
+if tex_nine_synctex is None:
+    echomsg("SyncTeX is not in use.")
+else:
+    for uri, proxy in sorted(tex_nine_synctex.proxies.items()):
+        times = list(proxy.latencies)
+        if times:
+            echomsg("{0}: {1} SyncView call(s), {2:.1f} ms on average, {3:.1f} ms at most".format(
+                uri, len(times), sum(times)/len(times), max(times)))
+        else:
+            echomsg("{0}: no SyncView calls".format(uri))
+EOF
+return
+endfunction
+
+function tex_nine#ClearCache()
+python << EOF
+omni.bibindex().clear()
+clear_caches()
+echomsg("Cleared caches in `{0}'.".format(cache_dir()))
+EOF
+return
+endfunction
+
 function tex_nine#IsLeft(lchar)
     let left = getline('.')[col('.')-2]
     return left == a:lchar ? 1 : 0
@@ -170,20 +223,15 @@ function tex_nine#SmartInsert(keyword, ...)
 endfunction
 
 function! ListEnvCompletions(A,L,P)
-    " Breaks if dictionary is a list but we only support one dictionary
-    " at the moment
-    if filereadable(&dictionary)
-        return join(readfile(&dictionary), "\<nl>")
-    else
-        return []
-    endif
+    return pyeval('document.complete_environments(vim.eval("a:A"), vim.eval("&ft"))')
 endfunction
 
 function tex_nine#InsertSnippet(...)
         if exists('a:1')
             let s:envkey = a:1
         else
-            let s:envkey = input('Environment: ', '', 'custom,ListEnvCompletions')
+            python document.update_environments(vim.current.buffer, vim.eval('&dictionary'), vim.eval('&ft'))
+            let s:envkey = input('Environment: ', '', 'customlist,ListEnvCompletions')
         endif
 
         if s:envkey != "" 
@@ -213,19 +261,29 @@ endfunction
 
 function tex_nine#AddBuffer(config, snipfile)
 python << EOF
-omni = TeXNineOmni()
-document = TeXNineDocument(vim.current.buffer)
-document.setup_snippets(vim.eval('a:snipfile'),
-                        vim.eval('&ft'))
+bufname = path.basename(vim.current.buffer.name)
+with timed("AddBuffer {0}: omni".format(bufname)):
+    omni = TeXNineOmni()
+with timed("AddBuffer {0}: document".format(bufname)):
+    document = TeXNineDocument(vim.current.buffer)
+with timed("AddBuffer {0}: snippets".format(bufname)):
+    document.setup_snippets(vim.eval('a:snipfile'),
+                            vim.eval('&ft'))
+if vim.eval('&ft') == 'tex':
+    with timed("AddBuffer {0}: prewarm".format(bufname)):
+        omni.prewarm(vim.current.buffer)
 
 EOF
 if a:config.synctex == 1
 python << EOF
 try:
-    target = document.get_master_output(vim.current.buffer)
-    evince_proxy = tex_nine_synctex.TeXNineSyncTeX(target, logging) 
-    document.buffers[vim.current.buffer.name]['synctex'] = evince_proxy
-except (TeXNineError, NameError) as e:
+    with timed("AddBuffer {0}: synctex".format(bufname)):
+        synctex = load_synctex()
+        if synctex is not None:
+            target = document.get_master_output(vim.current.buffer)
+            evince_proxy = synctex.get_proxy(target, logging)
+            document.buffers[vim.current.buffer.name]['synctex'] = evince_proxy
+except TeXNineError as e:
     msg = 'TeX-9: Failed to connect to an Evince window: {0}'.format(str(e).decode('string_escape'))
     logging.debug(msg)
     pass
@@ -237,6 +295,13 @@ function tex_nine#SetAutoCmds(config)
 
     augroup tex_nine
         au BufWritePre *.tex call tex_nine#UpdateHeader()
+        au! BufWritePost *.tex
+        au BufWritePost *.tex call tex_nine#FileWritten(expand('<afile>:p'))
+        au! BufUnload *.tex
+        au BufUnload *.tex call tex_nine#BufferUnloaded(expand('<afile>:p'))
+        if a:config.compile_on_save
+            au BufWritePost *.tex call tex_nine#CompileOnSave(str2nr(expand('<abuf>')))
+        endif
     augroup END
 
     "au QuickFixCmdPre <buffer> call tex_nine#Premake()
@@ -249,6 +314,16 @@ function tex_nine#SetAutoCmds(config)
     "endif
 endfunction
 
+function tex_nine#FileWritten(fname)
+    " The include graphs that contain the file are walked again
+    python document.file_written(vim.eval('a:fname'))
+endfunction
+
+function tex_nine#BufferUnloaded(fname)
+    " Releases the Evince window of an unloaded master file
+    python document.buffer_unloaded(vim.eval('a:fname'))
+endfunction
+
 function tex_nine#Reconfigure(config)
 python << EOF
 try:
@@ -284,88 +359,442 @@ endfunction
 "***********************************************************************
 
 
-function tex_nine#Compile(deep, config)
+function tex_nine#Compile(deep, config, ...)
+    " An optional third argument asks for a build in the background
+    " even if `async' is not set
 
     let tex_nine_compiler = tex_nine#GetCompiler(a:config)
     let master = tex_nine#GetMaster()
+    let background = a:0 && a:1
 
     if tex_nine_compiler == "" || master == ""
         return
-    elseif tex_nine_compiler == "make"
-        silent make!
+    elseif a:config.server && has('job') && tex_nine_compiler != "make"
+        " The build server of the master file does the work
+        call tex_nine#StartServer(a:deep, a:config)
+        return
+    elseif tex_nine_compiler != "make" && s:UpToDate(a:deep, tex_nine_compiler, master)
+        " Nothing changed since the last successful build
+        let s:watch.skipped += 1
+    elseif (a:config.async || background) && has('job')
+        call tex_nine#CompileAsync(a:deep, a:config, tex_nine_compiler, master)
+        return
     else
         update " Autowrite is not enough
-        exe "lcd" fnameescape(fnamemodify(master, ':h'))
         unsilent echo "Compiling...\r"
-        if a:deep == 1 
-            python document.compile(vim.current.buffer, vim.eval('tex_nine_compiler'))
-        endif
-        " Make and do not jump to the first error
-        exe 'silent' 'make!' escape(fnamemodify(master, ':t'), ' ')
-        lcd -
+        " Runs as many passes as needed, parse the last one
+        call setqflist(pyeval('document.compile(vim.current.buffer, vim.eval("tex_nine_compiler"), int(vim.eval("a:deep")), vim.eval("&l:makeprg"))'))
+    endif
+
+    if (!has("gui_running"))
+        redraw!
     endif
 
-    " Post-process errors
-    if !a:config.verbose
-        call setqflist(pyeval('document.postmake()'))
+    let numerrors = len(filter(getqflist(), 'v:val.type ==? "e"'))
+    unsilent echo "Found ".numerrors." Error(s).".pyeval('document.report()')
+
+endfunction
+
+function tex_nine#CompileProject(deep, config)
+    " Compiles every master file that includes the current file
+
+    let tex_nine_compiler = tex_nine#GetCompiler(a:config)
+    if tex_nine_compiler == ""
+        return
     endif
 
+    update " Autowrite is not enough
+    unsilent echo "Compiling...\r"
+    if has('job')
+        call s:StartProjectBuild(a:deep, tex_nine_compiler)
+        return
+    endif
+python << EOF
+try:
+    qflist = document.compile_project(vim.current.buffer,
+                                      vim.eval('tex_nine_compiler'),
+                                      int(vim.eval('a:deep')),
+                                      vim.eval('&l:makeprg'))
+except TeXNineError, e:
+    echoerr(e)
+    qflist = None
+EOF
+    if pyeval('qflist is None')
+        return
+    endif
+    call setqflist(pyeval('qflist'))
+
     if (!has("gui_running"))
         redraw!
     endif
 
-    let numerrors = len(filter(getqflist(), 'v:val.valid==1'))
+    let numerrors = len(filter(getqflist(), 'v:val.type ==? "e"'))
     unsilent echo "Found ".numerrors." Error(s)."
+endfunction
+
+function s:UpToDate(deep, compiler, master)
+    " Checks the build manifest. If no input changed since the last
+    " successful build, fills the quickfix list with its errors.
+
+    update " Autowrite is not enough
+    if !pyeval('document.up_to_date(vim.current.buffer, vim.eval("a:compiler"), int(vim.eval("a:deep")), vim.eval("&l:makeprg"))')
+        return 0
+    endif
+    call setqflist(pyeval('document.qflist'))
+    return 1
+endfunction
+
+"***********************************************************************
+" Asynchronous compilation (requires +job)
+"***********************************************************************
+
+function tex_nine#CompileAsync(deep, config, compiler, master)
+    " Runs the build steps one after the other as Vim jobs. The output
+    " of each LaTeX pass is added to the quickfix list as it arrives. A
+    " build that is still running is cancelled.
+
+    if exists('s:build')
+        let s:watch.superseded += 1
+    endif
+    call tex_nine#StopCompile()
+    update
+    python document.start_build(vim.current.buffer, vim.eval('a:compiler'), int(vim.eval('a:deep')), vim.eval('&l:makeprg'))
+
+    let s:build = {
+                \ 'config': a:config,
+                \ 'job': '',
+                \ 'pid': 0,
+                \ 'step': {},
+                \ 'output': [],
+                \ 'pending': []
+                \}
+    call setqflist([])
+    unsilent echo "Compiling...\r"
+    call s:NextStep()
+endfunction
+
+function tex_nine#StopCompile()
+    if exists('s:build') && type(s:build.job) != type('')
+                \ && job_status(s:build.job) == 'run'
+        call job_stop(s:build.job)
+    endif
+    unlet! s:build
+    python document.cancel_build()
+endfunction
+
+function s:NextStep()
+    let step = pyeval('document.next_step()')
+    if empty(step)
+        call s:BuildDone()
+        return
+    endif
+    let s:build.step = step
+    let s:build.output = []
+    let s:build.pending = []
+    if step.parse
+        " Only the errors of the last LaTeX pass are relevant
+        call setqflist([])
+    endif
+    let s:build.job = job_start(step.cmd, {
+                \ 'out_cb': function('s:OnOutput'),
+                \ 'err_cb': function('s:OnOutput'),
+                \ 'exit_cb': function('s:OnExit'),
+                \ 'in_io': 'null'
+                \})
+    let s:build.pid = job_info(s:build.job).process
+endfunction
 
+function s:OnOutput(channel, msg)
+    if !exists('s:build')
+        return
+    endif
+    call add(s:build.output, a:msg)
+    if s:build.step.parse
+        " Hand the output to the log parser in chunks
+        call add(s:build.pending, a:msg)
+        if a:msg == '' || len(s:build.pending) > 100
+            call s:FlushOutput()
+        endif
+    endif
+endfunction
+
+function s:FlushOutput()
+    if !empty(s:build.pending)
+        call setqflist(pyeval('document.read_output(vim.eval("s:build.pending"))'), 'a')
+        let s:build.pending = []
+    endif
+endfunction
+
+function s:OnExit(job, status)
+    if !exists('s:build') || job_info(a:job).process != s:build.pid
+        " Cancelled
+        return
+    endif
+    " Read the rest of the output before moving on
+    let channel = job_getchannel(a:job)
+    for line in s:ReadRest(channel)
+        call s:OnOutput(channel, line)
+    endfor
+    call s:FlushOutput()
+    call setqflist(pyeval('document.step_done(int(vim.eval("a:status")), vim.eval("s:build.output"))'), 'a')
+    call s:NextStep()
+endfunction
+
+function s:ReadRest(channel)
+    " Returns the lines of both stdout and stderr of a:channel that the
+    " callbacks have not got yet
+    let lines = []
+    for part in ['out', 'err']
+        while ch_status(a:channel, {'part': part}) == 'buffered'
+            call add(lines, ch_read(a:channel, {'part': part}))
+        endwhile
+    endfor
+    return lines
+endfunction
+
+function s:BuildDone()
+    let config = s:build.config
+    unlet s:build
+
+    call setqflist(pyeval('document.bibtex_entries()'), 'a')
+
+    let numerrors = len(filter(getqflist(), 'v:val.type ==? "e"'))
+    unsilent echo "Found ".numerrors." Error(s).".pyeval('document.report()')
+
+    if config.compile_callback != ''
+        call call(config.compile_callback, [{'errors': numerrors}])
+    endif
+endfunction
+
+"***********************************************************************
+" Project builds (requires +job)
+"***********************************************************************
+
+function s:StartProjectBuild(deep, compiler)
+    " Builds the master files that include the current file as Vim jobs,
+    " several at the same time. A project build that is still running
+    " is cancelled.
+
+    call tex_nine#StopProjectBuild()
+python << EOF
+try:
+    document.start_project_build(vim.current.buffer,
+                                 vim.eval('a:compiler'),
+                                 int(vim.eval('a:deep')),
+                                 vim.eval('&l:makeprg'))
+    started = 1
+except TeXNineError, e:
+    echoerr(e)
+    started = 0
+EOF
+    if !pyeval('started')
+        return
+    endif
+    let s:project = {'jobs': {}}
+    call s:NextProjectSteps()
+endfunction
+
+function tex_nine#StopProjectBuild()
+    if exists('s:project')
+        for running in values(s:project.jobs)
+            if job_status(running.job) == 'run'
+                call job_stop(running.job)
+            endif
+        endfor
+    endif
+    unlet! s:project
+    python document.cancel_project_build()
+endfunction
+
+function s:NextProjectSteps()
+    for step in pyeval('document.next_project_steps()')
+        let job = job_start(step.cmd, {
+                    \ 'out_cb': function('s:OnProjectOutput', [step.id]),
+                    \ 'err_cb': function('s:OnProjectOutput', [step.id]),
+                    \ 'exit_cb': function('s:OnProjectExit', [step.id]),
+                    \ 'in_io': 'null'
+                    \})
+        let s:project.jobs[step.id] = {'job': job, 'output': [],
+                    \ 'pid': job_info(job).process}
+    endfor
+    if empty(s:project.jobs)
+        call s:ProjectBuildDone()
+    endif
+endfunction
+
+function s:OnProjectOutput(id, channel, msg)
+    if exists('s:project') && has_key(s:project.jobs, a:id)
+        call add(s:project.jobs[a:id].output, a:msg)
+    endif
+endfunction
+
+function s:OnProjectExit(id, job, status)
+    if !exists('s:project') || !has_key(s:project.jobs, a:id)
+                \ || job_info(a:job).process != s:project.jobs[a:id].pid
+        " Cancelled
+        return
+    endif
+    " Read the rest of the output before moving on
+    let channel = job_getchannel(a:job)
+    for line in s:ReadRest(channel)
+        call s:OnProjectOutput(a:id, channel, line)
+    endfor
+    let finished = remove(s:project.jobs, a:id)
+    python document.project_step_done(int(vim.eval('a:id')), int(vim.eval('a:status')), vim.eval('finished.output'))
+    call s:NextProjectSteps()
+endfunction
+
+function s:ProjectBuildDone()
+    unlet s:project
+    call setqflist(pyeval('document.finish_project_build()'))
+
+    let numerrors = len(filter(getqflist(), 'v:val.type ==? "e"'))
+    unsilent echo "Found ".numerrors." Error(s)."
+endfunction
+
+"***********************************************************************
+" Build servers (requires +job)
+"***********************************************************************
+
+let s:servers = {}
+
+function tex_nine#StartServer(deep, config)
+    " Starts a build server for the master file of the current buffer,
+    " or asks the running server to build.
+
+    let tex_nine_compiler = tex_nine#GetCompiler(a:config)
+    let master = tex_nine#GetMaster()
+    if tex_nine_compiler == "" || master == ""
+        return
+    endif
+
+    update
+    if has_key(s:servers, master) && job_status(s:servers[master]) == 'run'
+        call ch_sendraw(s:servers[master], json_encode({'cmd': 'build', 'deep': a:deep})."\n")
+    else
+        let cmd = pyeval('document.server_command(vim.current.buffer, vim.eval("tex_nine_compiler"), int(vim.eval("a:deep")), vim.eval("&l:makeprg"))')
+        let s:servers[master] = job_start(cmd, {
+                    \ 'out_cb': function('s:OnServerMessage', [a:config]),
+                    \ 'err_cb': function('s:OnServerError'),
+                    \})
+    endif
+    unsilent echo "Compiling...\r"
+endfunction
+
+function tex_nine#StopServer()
+    " Stops all build servers
+    for job in values(s:servers)
+        if job_status(job) == 'run'
+            call ch_sendraw(job, json_encode({'cmd': 'stop'})."\n")
+        endif
+    endfor
+    let s:servers = {}
+endfunction
+
+function s:OnServerMessage(config, channel, msg)
+    let message = json_decode(a:msg)
+    python document.add_biberrors(vim.eval('message.bibtex'))
+    call setqflist(message.entries + pyeval('document.bibtex_entries(vim.eval("message.master"))'))
+
+    let numerrors = len(filter(getqflist(), 'v:val.type ==? "e"'))
+    unsilent echo "Found ".numerrors." Error(s)."
+
+    if a:config.compile_callback != ''
+        call call(a:config.compile_callback, [{'errors': numerrors}])
+    endif
+endfunction
+
+function s:OnServerError(channel, msg)
+    python logging.debug("TeX-9: Build server: "+vim.eval('a:msg'))
+endfunction
+
+"***********************************************************************
+" Compile on save (requires +timers and +job)
+"***********************************************************************
+
+" Counters for tuning the debounce window
+let s:watch = {'saves': 0, 'builds': 0, 'coalesced': 0, 'superseded': 0,
+            \ 'skipped': 0, 'timers': {}}
+
+function tex_nine#CompileOnSave(bufnr)
+    " Schedules a background build of the master file of buffer a:bufnr.
+    " Saves within `debounce' milliseconds of each other are coalesced
+    " into one build.
+
+    let config = getbufvar(a:bufnr, 'tex_nine_config')
+    if empty(config) || !config.compile_on_save
+        return
+    endif
+    let s:watch.saves += 1
+    let deep = config.compile_on_save > 1
+
+    if !has('timers') || !has('job') || !exists('*win_execute')
+        if a:bufnr == bufnr('%')
+            call tex_nine#Compile(deep, config)
+        endif
+        return
+    endif
+
+    let master = pyeval('document.master_of('.a:bufnr.')')
+    if master == ""
+        return
+    elseif has_key(s:servers, master) && job_status(s:servers[master]) == 'run'
+        " The build server notices the change itself
+        return
+    endif
+    if has_key(s:watch.timers, master)
+        call timer_stop(s:watch.timers[master].timer)
+        let s:watch.coalesced += 1
+    endif
+    let s:watch.timers[master] = {'bufnr': a:bufnr, 'deep': deep,
+                \ 'timer': timer_start(config.debounce, function('s:WatchBuild', [master]))}
+endfunction
+
+function s:WatchBuild(master, timer)
+    let pending = remove(s:watch.timers, a:master)
+    " Compile from a window that shows the project
+    let winid = bufwinid(pending.bufnr)
+    if winid == -1
+        let winid = bufwinid(a:master)
+    endif
+    if winid == -1
+        return
+    endif
+    let s:watch.builds += 1
+    call win_execute(winid, 'call tex_nine#Compile('.pending.deep.', b:tex_nine_config, 1)')
+endfunction
+
+function tex_nine#CompileStats()
+    " Returns the counters of the compile-on-save mode
+    return filter(copy(s:watch), 'v:key != "timers"')
 endfunction
 
 function tex_nine#ConfigureCompiler(compiler, synctex, shell_escape, extra_args)
     " Configure the l:makeprg variable according to user's preference
 
-    let &l:makeprg = a:compiler
-    if &l:makeprg != 'make'
-        let &l:makeprg .= ' -file-line-error -interaction=nonstopmode'
+    let &l:makeprg = tex_nine#MakePrg(a:compiler, a:synctex, a:shell_escape, a:extra_args)
+
+    " TeX-9 parses the output of its own builds; this is only for a plain
+    " :make. Errors come as file:line: thanks to -file-line-error.
+    " Warnings are listed without a location.
+    setlocal errorformat=%f:%l:\ %m,
+                \%+G%.%#\ Warning:\ %.%#,
+                \%-G%.%#
+endfunction
+
+function tex_nine#MakePrg(compiler, synctex, shell_escape, extra_args)
+    " Returns the value of 'makeprg' for the compiler
+
+    let makeprg = a:compiler
+    if makeprg != 'make'
+        let makeprg .= ' -file-line-error -interaction=nonstopmode'
         if a:synctex
-            let &l:makeprg .= ' -synctex=1'
+            let makeprg .= ' -synctex=1'
         endif
         if a:shell_escape
-            let &l:makeprg .= ' -shell-escape'
+            let makeprg .= ' -shell-escape'
         endif
-        let &l:makeprg .= ' '.a:extra_args
-    endif
-    let &l:makeprg .= ' $*'
-
-    " TODO: test Makefile
-    " This is taken from vim help, see :help errorformat-LaTeX, with
-    " addition from Srinath Avadhanula <srinath@fastmail.fm>
-    setlocal errorformat=%E!\ LaTeX\ %trror:\ %m,
-                \%E%f:%l:\ %m,
-                \%E!\ %m,
-                \%+WLaTeX\ %.%#Warning:\ %.%#line\ %l%.%#,
-                \%+W%.%#\ at\ lines\ %l--%*\\d,
-                \%WLaTeX\ %.%#Warning:\ %m,
-                \%Cl.%l\ %m,
-                \%+C\ \ %m.,
-                \%+C%.%#-%.%#,
-                \%+C%.%#[]%.%#,
-                \%+C[]%.%#,
-                \%+C%.%#%[{}\\]%.%#,
-                \%+C<%.%#>%.%#,
-                \%C\ \ %m,
-                \%-GSee\ the\ LaTeX%m,
-                \%-GType\ \ H\ <return>%m,
-                \%-G\ ...%.%#,
-                \%-G%.%#\ (C)\ %.%#,
-                \%-G(see\ the\ transcript%.%#),
-                \%-G\\s%#,
-                \%+O(%*[^()])%r,
-                \%+O%*[^()](%*[^()])%r,
-                \%+P(%f%r,
-                \%+P\ %\\=(%f%r,
-                \%+P%*[^()](%f%r,
-                \%+P[%\\d%[^()]%#(%f%r,
-                \%+Q)%r,
-                \%+Q%*[^()])%r,
-                \%+Q[%\\d%*[^()])%r
-
+        let makeprg .= ' '.a:extra_args
+    endif
+    return makeprg.' $*'
 endfunction
@@ -85,6 +85,7 @@ noremap <buffer><silent> <LocalLeader>V :call tex_nine#ViewDocument()<CR>
 " Compilation
 noremap <buffer><silent> <LocalLeader>k :call tex_nine#Compile(0, b:tex_nine_config)<CR>
 noremap <buffer><silent> <LocalLeader>K :call tex_nine#Compile(1, b:tex_nine_config)<CR>
+noremap <buffer><silent> <LocalLeader>P :call tex_nine#CompileProject(1, b:tex_nine_config)<CR>
 
 " Misc
 noremap <buffer><silent> <LocalLeader>U :call tex_nine#Reconfigure(b:tex_nine_config)<CR>
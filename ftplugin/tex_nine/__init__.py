@@ -30,15 +30,41 @@
 import vim
 import sys
 import re
-import subprocess
-import os
 import os.path as path
 import logging
+import time
+import threading
 
-from getpass import getuser
+from collections import OrderedDict
+from contextlib import contextmanager
 from time import strftime
 from itertools import groupby
 from string import Template
+from pipes import quote
+
+# Milliseconds spent in the imports and in the steps of
+# tex_nine#AddBuffer() as a list of 2-tuples (step, ms). Modules that
+# only some commands need are imported on first use with load_module().
+startup_times = []
+_started = time.time()
+
+@contextmanager
+def timed(step):
+    """Adds the time spent in the `with' block to startup_times."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        startup_times.append((step, 1000*(time.time() - start)))
+
+def load_module(name):
+    """Returns the module `name', importing it if needed."""
+    if name not in sys.modules:
+        with timed("import "+name):
+            __import__(name)
+        logging.debug("TeX-9: Imported `{0}' in {1:.1f} ms".format(
+            name, startup_times[-1][1]))
+    return sys.modules[name]
 
 #Local modules
 # config = vim.bindeval('b:tex_nine_config')
@@ -50,37 +76,95 @@ config['disable'] = int(config['disable'])
 config['debug'] = int(config['debug'])
 config['synctex'] = int(config['synctex'])
 config['verbose'] = int(config['verbose'])
+config['cache'] = int(config['cache'])
+config['worker'] = int(config['worker'])
+config['worker_budget'] = int(config['worker_budget'])
+config['pics_depth'] = int(config['pics_depth'])
+config['fuzzy'] = int(config['fuzzy'])
+config['max_passes'] = int(config['max_passes'])
+config['manifest'] = int(config['manifest'])
+config['jobs'] = int(config['jobs'])
+config['master_levels'] = int(config['master_levels'])
+config['server_interval'] = int(config['server_interval'])
+config['preamble'] = int(config['preamble'])
+config['draft'] = int(config['draft'])
 
 sys.path.extend([config['_pypath']])
-from tex_nine_symbols import tex_nine_maths_cache
-from tex_nine_utils import *
+# The symbols, BibTeX, pictures, build and SyncTeX modules are imported
+# on first use
+with timed("import tex_nine_utils"):
+    from tex_nine_utils import *
+with timed("import tex_nine_cache"):
+    from tex_nine_cache import TeXNineCache, cache_dir, cache_info, clear_caches
+with timed("import tex_nine_project"):
+    from tex_nine_project import TeXNineProject, TeXNineFileReader, TeXNineMasterIndex
+with timed("import tex_nine_worker"):
+    from tex_nine_worker import TeXNineWorker, TeXNineLogHandler
 
 # Control debugging
 if config['debug']:
-    logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
+    # Background jobs must not write to Vim: the handler holds their
+    # messages until the main thread logs
+    handler = TeXNineLogHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.DEBUG)
 else:
     logging.basicConfig(level=logging.ERROR)
 
 # Control SyncTeX
 # TODO: Python 3 support
-if config['synctex']:
-    if int(vim.eval("has('gui_running')")):
-        if not int(vim.eval("has('python3')")): 
-            logging.debug("TeX-9: Importing tex_nine_synctex") 
-            # NB: Important side effect: Vim will be hooked to the DBus session daemon
-            import tex_nine_synctex
-        else:
+tex_nine_synctex = None
+
+def make_program(compiler):
+    """Returns the 'makeprg' that tex_nine#ConfigureCompiler() sets for
+    `compiler' with the options of the current buffer."""
+    return vim.eval('tex_nine#MakePrg("{0}", b:tex_nine_config.synctex, '
+                    'b:tex_nine_config.shell_escape, '
+                    'b:tex_nine_config.extra_args)'.format(compiler.replace('"', '')))
+
+def load_synctex():
+    """Imports tex_nine_synctex when SyncTeX is first used.
+
+    Returns None if SyncTeX is disabled or Evince cannot be used; the
+    SyncTeX file is then read by TeXNineSyncTeXReader instead.
+    """
+    global tex_nine_synctex
+    if tex_nine_synctex is None and config['synctex']:
+        if not int(vim.eval("has('gui_running')")):
+            logging.debug("TeX-9: Evince is not available in terminal.")
+        elif int(vim.eval("has('python3')")):
             echoerr("Must not have +python3 when using SyncTeX.")
-    else:
-        echomsg("SyncTeX not available in terminal.")
+        else:
+            # NB: Important side effect: Vim will be hooked to the DBus session daemon
+            tex_nine_synctex = load_module('tex_nine_synctex')
+        if tex_nine_synctex is None:
+            config['synctex'] = 0
+    return tex_nine_synctex
 
 # Miscellaneous extra settings
 config['_datelabel'] = '%  Last Change:'
 config['_timestr'] = '%Y %b %d'
 
+# Fonts are installed or removed when these change
+fontconfig_cache_dirs = ['/var/cache/fontconfig', '~/.cache/fontconfig',
+                         '~/.fontconfig']
+
 # Start of the main module
 logging.debug("TeX-9: Entering the Python module.")
 
+maths_index = None
+
+def get_maths_index():
+    """Returns the index of maths symbols, building it on first use."""
+    global maths_index
+    if maths_index is None:
+        symbols = load_module('tex_nine_symbols')
+        # User defined symbols extend and override the built-in table
+        maths_index = TeXNineSymbolIndex(symbols.tex_nine_maths_cache,
+                                         config['symbols'])
+    return maths_index
+
 messages = {
         'NO_BIBTEX': 'No BibTeX databases present...',
         'INVALID_BIBFILE': 'Invalid BibTeX file: `{0}\'',
@@ -92,7 +176,10 @@ messages = {
         'NO_OUTPUT':  'Output file `{0}\' does not exist.',
         'INVALID_HEADER': r'Missing information in header.',
         'NO_BIBSTYLE': r'No valid bibliography style found in the document.',
-        'NO_COMPILER': r'Compiler unknown.'
+        'NO_COMPILER': r'Compiler unknown.',
+        'NO_MASTERS': 'No master file includes `{0}\'',
+        'NO_SYNCTEX': 'Cannot read the SyncTeX file of `{0}\': compile with SyncTeX enabled',
+        'NO_SYNC': 'Cannot find line {0} of `{1}\' in the SyncTeX file'
 }
 
 class TeXNineBase(object):
@@ -100,6 +187,7 @@ class TeXNineBase(object):
 
     _instance = None
     buffers = {}
+    _masters = TeXNineMasterIndex(levels=config['master_levels'])
 
     def __new__(self, *args, **kwargs):
         if self._instance is None:
@@ -115,6 +203,7 @@ class TeXNineBase(object):
         bufinfo = {
             'ft' : vim.eval('&ft'),
             'master': "",
+            'generation': None,
             'buffer': vimbuffer,
             'synctex': None
         }
@@ -125,23 +214,26 @@ class TeXNineBase(object):
     def find_master_file(self, vimbuffer, nlines=3):
         """Finds the filename of the master file in a LaTeX project.
 
-        Checks if `vimbuffer' contains a \documentclass statement and sets
-        the master file to `vimbuffer.name'. Otherwise checks the
-        `nlines' first and `nlines' last lines for modeline of the form
+        Looks up `vimbuffer' in the reverse include index first: a master
+        file is its own master and a file included by master files
+        gets one of them, preferably one that is loaded in Vim. The
+        `nlines' first and `nlines' last lines of `vimbuffer' may
+        override the index with a modeline of the form
 
         % mainfile: <master_file>
 
         where <master_file> is the path of the master file relative to
-        the master file, e.g. ../main.tex.
+        the master file, e.g. ../main.tex. Files that are not indexed
+        (yet) are masters if they contain a \documentclass statement.
 
         Raises `TeXNineError' if master cannot be found.
 
         """
 
         # Most often this is the case
-        for line in vimbuffer:
-            if '\\documentclass' in line: 
-                return vimbuffer.name
+        if self._masters.is_master(vimbuffer.name):
+            return vimbuffer.name
+        masters = self._masters.masters(vimbuffer.name, nearest=True)
 
         # Look for modeline
         for line in vimbuffer[:nlines]+vimbuffer[-nlines:]:
@@ -157,23 +249,65 @@ class TeXNineBase(object):
                     e = messages['INVALID_MODELINE'].format(match.group(1)) 
                     raise TeXNineError(e)
 
+        if masters:
+            loaded = [m for m in masters if m in self.buffers]
+            return (loaded or masters)[0]
+
+        # A new or unsaved master file
+        for line in vimbuffer:
+            if '\\documentclass' in line: 
+                return vimbuffer.name
+
         # Empty buffer, no match or no read access to master 
         raise TeXNineError(messages['NO_MODELINE'])
 
+    def master_of(self, bufnr):
+        """Returns the master file of the buffer number `bufnr' or an
+        empty string if it cannot be determined."""
+        try:
+            return self.get_master_file(vim.buffers[bufnr])
+        except (TeXNineError, KeyError):
+            return ""
+
     def get_master_file(self, vimbuffer):
-        """Returns the filename of the master file."""
+        """Returns the filename of the master file.
+
+        The master file is looked up again when the include graph of
+        some master file changed; see file_written().
+        """
 
-        if not self.buffers[vimbuffer.name]['master']:
+        bufinfo = self.buffers[vimbuffer.name]
+        generation = self._masters.generation
+        if not bufinfo['master'] or bufinfo['generation'] != generation:
             master = self.find_master_file(vimbuffer)
-            self.buffers[vimbuffer.name]['master'] = master
+            bufinfo['master'] = master
+            bufinfo['generation'] = self._masters.generation
 
             # Make sure master knows it's the master
             masterinfo = self.buffers.get(master)
             if masterinfo is not None:
                 masterinfo['master'] = master
+                masterinfo['generation'] = self._masters.generation
 
         return self.buffers[vimbuffer.name]['master']
 
+    def buffer_unloaded(self, fname):
+        """Releases the Evince window proxy of the buffer `fname' if no
+        other buffer uses it."""
+        bufinfo = self.buffers.get(fname)
+        if bufinfo is None or bufinfo['synctex'] is None:
+            return
+        proxy = bufinfo['synctex']
+        bufinfo['synctex'] = None
+        if not any(b['synctex'] is proxy for b in self.buffers.values()):
+            logging.debug("TeX-9: Releasing the Evince window of `{0}'".format(proxy.uri))
+            load_synctex().release_proxy(proxy)
+
+    def file_written(self, fname):
+        """Notes that `fname' was written: the include graphs of the
+        projects it belongs to are walked again on the next lookup."""
+        self._masters.invalidate(fname)
+
     @staticmethod
     def multi_file(f):
         """Decorates methods that need to know the actual master file in
@@ -232,17 +366,83 @@ class TeXNineBibTeX(TeXNineBase):
 
     _bibcompletions = []
     _bibpaths = set([])
+    _bibresolved = {}
+    _bibindex = None
+    _bibindex_lock = threading.Lock()
 
-    def _bibparser(self, fname):
-        """Opens a file and extracts all BibTeX entries in it."""
-        try:
-            with open(fname) as f:
-                logging.debug("TeX-9: Reading BibTeX entries from `{0}'".format(path.basename(fname)))
-                return re.findall('^@\w+ *{\s*([^, ]+) *,', f.read(), re.M)
+    _worker = TeXNineWorker(threaded=config['worker'])
 
-        except IOError:
-            echoerr(messages["INVALID_BIBFILE"].format(fname))
-            return []
+    def bibindex(self):
+        """Returns the index of BibTeX entries, creating it on first
+        use. Both the worker and the main thread may get here first."""
+        with self._bibindex_lock:
+            if TeXNineBibTeX._bibindex is None:
+                bibtex = load_module('tex_nine_bibtex')
+                cache = TeXNineCache('bibtex', version=2) if config['cache'] else None
+                TeXNineBibTeX._bibindex = bibtex.TeXNineBibIndex(cache)
+        return self._bibindex
+
+    def _bibparser(self, bibpaths):
+        """Indexes the BibTeX entries in the files `bibpaths'.
+
+        A file is parsed only if it has changed since it was indexed.
+        Returns a 2-tuple (completions, errors).
+
+        Does not touch Vim so that it can run in the background.
+        """
+
+        errors = []
+        changed = False
+        bibindex = self.bibindex()
+        for fname in bibpaths:
+            try:
+                changed |= bool(bibindex.refresh([fname]))
+            except IOError:
+                errors.append(messages["INVALID_BIBFILE"].format(fname))
+                changed |= bool(bibindex.entries([fname]))
+                bibindex.discard(fname)
+
+        if changed or not self._bibcompletions:
+            entries = bibindex.entries(bibpaths)
+            format_entry = load_module('tex_nine_bibtex').format_entry
+            self._bibcompletions = map(format_entry, entries)
+        return (self._bibcompletions, errors)
+
+    def _resolve_bibfiles(self, dirname, bibfiles):
+        """Finds the absolute paths of BibTeX files.
+
+        Files in `dirname' take precedence. The rest are looked up with
+        one call to kpsewhich. Results are cached for the session in
+        `_bibresolved' keyed on (dirname, filename); update() clears the
+        cache. Unresolved files map to the empty string.
+        """
+
+        start = time.time()
+        resolved = {}
+        missing = []
+        for b in bibfiles:
+            bibpath = self._bibresolved.get((dirname, b))
+            if bibpath and path.exists(bibpath):
+                resolved[b] = bibpath
+                continue
+            # Check if the bibfile is in the compilation folder
+            bibtemp = path.join(dirname, b)
+            if path.exists(bibtemp):
+                resolved[b] = path.abspath(bibtemp)
+            else:
+                missing.append(b)
+
+        if missing:
+            resolved.update(load_module('tex_nine_bibtex').kpsewhich(missing))
+
+        for b in bibfiles:
+            resolved.setdefault(b, "")
+            if resolved[b]:
+                self._bibresolved[(dirname, b)] = resolved[b]
+
+        logging.debug("TeX-9: Resolved {0} BibTeX files ({1} with kpsewhich) in {2:.1f} ms".format(
+            len(bibfiles), len(missing), 1000*(time.time() - start)))
+        return resolved
 
     @property
     def bibpaths(self):
@@ -276,56 +476,133 @@ class TeXNineBibTeX(TeXNineBase):
 
         if not self._bibpaths or update:
             # Find out the bibfiles in use
-            master = vimbuffer.name 
-            masterbuffer = "\n".join(vimbuffer[:])
-            if not masterbuffer:
-                e = messages['MASTER_NOT_ACTIVE'].format(path.basename(master))
-                raise TeXNineError(e)
-            else:
-                match = re.search(r'\\bibliography{([^}]+)}',
-                                  masterbuffer)
-                if not match:
-                    e = messages['NO_BIBTEX']
-                    raise TeXNineError(e)
-
-                bibfiles = match.group(1).split(',')
-                dirname = path.dirname(master)
-                # Find the absolute paths of the bibfiles
-                for b in bibfiles:
-                    b += '.bib'
-                    # Check if the bibfile is in the compilation folder
-                    bibtemp = path.join(dirname, b)
-                    b = ( bibtemp if path.exists(bibtemp) else b )
-                    # Get the path with kspewhich
-                    proc = subprocess.Popen(['kpsewhich','-must-exist', b],
-                                            stdout=subprocess.PIPE)
-                    bibpath = proc.communicate()[0].strip('\n')
-                    # kpsewhich return either the full path or an empty
-                    # string.
-                    if bibpath:
-                        self._bibpaths.add(bibpath)
-                    else:
-                        raise TeXNineError(messages["INVALID_BIBFILE"].format(b))
+            dirname, bibfiles = self.get_bibfiles(vimbuffer)
+            resolved = self._resolve_bibfiles(dirname, bibfiles)
+            for b in bibfiles:
+                bibpath = resolved[b]
+                if bibpath:
+                    self._bibpaths.add(bibpath)
+                else:
+                    raise TeXNineError(messages["INVALID_BIBFILE"].format(b))
 
         return list(self._bibpaths)
 
-    def get_bibentries(self):
-        """Returns a list of BibTeX entries found in the BibTeX files."""
-        if not self._bibcompletions:
-            bibpaths = self.get_bibpaths(vim.current.buffer)
-            for b in bibpaths:
-                self._bibcompletions += self._bibparser(b)
-        return self._bibcompletions
+    @TeXNineBase.multi_file
+    def get_bibfiles(self, vimbuffer):
+        """Returns the directory of the master file and the names of
+        the BibTeX files in its \\bibliography statement. Does not
+        look the files up."""
+
+        master = vimbuffer.name 
+        masterbuffer = "\n".join(vimbuffer[:])
+        if not masterbuffer:
+            e = messages['MASTER_NOT_ACTIVE'].format(path.basename(master))
+            raise TeXNineError(e)
+
+        match = re.search(r'\\bibliography{([^}]+)}', masterbuffer)
+        if not match:
+            e = messages['NO_BIBTEX']
+            raise TeXNineError(e)
+
+        bibfiles = [b.strip()+'.bib' for b in match.group(1).split(',')]
+        return (path.dirname(master), bibfiles)
+
+    def get_bibentries(self, budget=None):
+        """Returns a list of BibTeX entries found in the BibTeX files.
+
+        Only databases that changed on disk are parsed again. The
+        parsing happens in the background; if it takes longer than
+        `budget' seconds, the entries found previously are returned.
+        """
+        bibpaths = self.get_bibpaths(vim.current.buffer)
+        # Import the module here rather than in the background job
+        self.bibindex()
+        job = lambda: self._bibparser(bibpaths)
+        entries, errors = self._worker.call('bib', job, budget, ([], []))
+        for e in errors:
+            echoerr(e)
+        return entries
 
     def update(self, bibpaths=[]):
+        # Parsed databases are kept in the index
         self._bibcompletions = []
         self._bibpaths.clear()
+        self._bibresolved.clear()
         if bibpaths:
             for p in bibpaths: 
                 self._bibpaths.add(p)
         else:
             self.get_bibpaths(vim.current.buffer, update=True)
 
+class TeXNineBufferReader(TeXNineFileReader):
+    """Reads files from Vim buffers when they are loaded.
+
+    The stamp of a loaded buffer is its b:changedtick so that unsaved
+    changes, also in buffers other than the current one, are seen
+    without writing anything to disk. Other files are read from disk.
+
+    Call update() on the main thread before a batch of reads. It takes
+    a snapshot of the loaded buffers so that stamp() and read() never
+    touch Vim and can be used in the background. A background job reads
+    within use() from the snapshot it was given so that a later update()
+    does not change the buffers under its feet.
+    """
+
+    def __init__(self):
+        self._snapshot = {}
+        self._local = threading.local()
+
+    def update(self, known={}, names=()):
+        """Takes a snapshot of the loaded buffers of a project and
+        returns it.
+
+        Only the buffers of the files in `known', the files of the
+        project, and in `names' are copied, and only if they changed
+        since the previous snapshot.
+        """
+        previous = self._snapshot
+        snapshot = {}
+        for b in vim.buffers:
+            if not b.name or (b.name not in known and b.name not in names):
+                continue
+            if int(vim.eval('bufloaded({0})'.format(b.number))):
+                tick = vim.eval('getbufvar({0}, "changedtick")'.format(b.number))
+                stamp = ('changedtick', int(tick))
+                if b.name in previous and previous[b.name][0] == stamp:
+                    snapshot[b.name] = previous[b.name]
+                else:
+                    snapshot[b.name] = (stamp, b[:])
+        self._snapshot = snapshot
+        return snapshot
+
+    @contextmanager
+    def use(self, snapshot):
+        """Makes the calling thread read from `snapshot' in the with
+        block."""
+        self._local.snapshot = snapshot
+        try:
+            yield
+        finally:
+            self._local.snapshot = None
+
+    def _buffer(self, fname):
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is None:
+            snapshot = self._snapshot
+        return snapshot.get(fname)
+
+    def stamp(self, fname):
+        record = self._buffer(fname)
+        if record is None:
+            return TeXNineFileReader.stamp(self, fname)
+        return record[0]
+
+    def read(self, fname):
+        record = self._buffer(fname)
+        if record is None:
+            return TeXNineFileReader.read(self, fname)
+        return record[1]
+
 class TeXNineOmni(TeXNineBibTeX):
     """Vim's omni completion for a LaTeX document.
 
@@ -342,87 +619,132 @@ class TeXNineOmni(TeXNineBibTeX):
     
     """
 
+    _project = None
+    _fontlist = (None, [])
+    _fontcache = TeXNineCache('fonts')
+    _pictures = None
+
     def __init__(self, bibfiles=[]):
         self.keyword = None
+        if self._project is None:
+            TeXNineOmni._project = TeXNineProject(TeXNineBufferReader())
 
     @TeXNineBase.multi_file
-    def _labels(self, vimbuffer,
-                pat=re.compile(r'\\label{(?P<label>[^,}]+)}|\\in(?:clude|put){(?P<fname>[^}]+)}')):
+    def _labels(self, vimbuffer, budget=None):
         """Labels for references.
 
-        Searches \label{} statements in the master file and in
-        \include'd and \input'd files. 
+        Searches \label{} statements in the master file and in all
+        files that are \include'd, \input'ed, \subfile'd or
+        \import'ed in it, recursively. Only files that changed since
+        the previous completion are scanned again. Loaded buffers are
+        read from memory.
         
         * Thanks to TeX's clunky design, included files cannot contain
         "special" characters such as whitespace.
         """
 
-        vim.command('update')
-        labels = []
-        masterbuffer = "\n".join(vimbuffer[:])
-        master_folder, basename  = path.split(vimbuffer.name)
-        match = pat.findall(masterbuffer)
+        master = vimbuffer.name
+        master_folder = path.dirname(master)
+        reader = self._project.reader
+        snapshot = reader.update(self._project.stamps(), [master])
 
-        if not match:
-            if not masterbuffer:
-                e = messages['MASTER_NOT_ACTIVE'].format(basename)
-                raise TeXNineError(e)
+        def job():
+            with reader.use(snapshot):
+                labels = [dict(word=l, menu=path.relpath(f, master_folder))
+                          for l, f in self._project.labels(master)]
             logging.debug('TeX-9: Found {0} labels'.format(len(labels)))
             return labels
 
-        labels, included = zip(*match)
-        labels = filter(None, labels)
-        included = filter(None, included)
-
-        labels = [dict(word=i, menu=basename) for i in labels]
-        for fname in included:
-
-            logging.debug("TeX-9: Reading from included file `{0}'...".format(fname))
-
-            if not fname.endswith('.tex'):
-                fname += '.tex'
-
-            try:
-                with open(path.join(master_folder, fname), 'r') as f:
-                    inc_labels = re.findall(r'\\label{(?P<label>[^,}]+)}',
-                                            f.read()) 
-                    inc_labels = [dict(word=i, menu=fname) for i in inc_labels] 
-                    labels += inc_labels
-            except IOError, e:
-                # Do not raise an error because the \include statement might
-                # be commented
-                logging.debug(str(e).decode('string_escape'))
-
-        logging.debug('TeX-9: Found {0} labels'.format(len(labels)))
-        return labels
+        return self._worker.call('labels', job, budget, [])
 
     def _fonts(self):
         """Installed fonts.
 
+        The list of font families is kept in memory and on disk. It is
+        rebuilt only when fontconfig's cache directories change, i.e.
+        when fonts are installed or removed.
+
         WARNING: Requires fontconfig.
         """
+
+        stamp = path_stamp(map(path.expanduser, fontconfig_cache_dirs))
+        if self._fontlist[0] == stamp:
+            return self._fontlist[1]
+
+        cached = self._fontcache.load() if config['cache'] else None
+        if cached and cached[0] == stamp:
+            self._fontlist = cached
+            return cached[1]
+
+        subprocess = load_module('subprocess')
         proc = subprocess.Popen(['fc-list', ':', 'family'],
                                 stdout=subprocess.PIPE)
         output = proc.communicate()[0].splitlines()
         output.sort()
         output = [ i for i,j in groupby(output, lambda x: re.split('[:,]', x)[0]) ]
+        self._fontlist = (stamp, output)
+        if config['cache']:
+            self._fontcache.save(self._fontlist)
+        logging.debug("TeX-9: Found {0} font families".format(len(output)))
         return output
 
-    def _pics(self):
-        """Picture completion."
+    def _pics(self, master):
+        """Picture completion.
+
+        Checks the compilation directory and the directories given in
+        \graphicspath and their subdirectories down to
+        `g:tex_nine_config.pics_depth' levels. Directories are listed
+        again only when they change.
 
-        Checks the compilation directory and its subdirectories.
+        Does not touch Vim so that it can run in the background.
         """
-        extensions = [ '.PDF', '.PNG', '.JPG', '.JPEG', '.EPS', 
-                      '.pdf', '.png', '.jpg', '.jpeg', '.eps' ]
+        if self._pictures is None:
+            graphics = load_module('tex_nine_graphics')
+            TeXNineOmni._pictures = graphics.TeXNinePictures(depth=config['pics_depth'])
+        roots = [path.dirname(master)] + self._project.graphicspath(master)
+        return self._pictures.pictures(roots)
+
+    @TeXNineBase.multi_file
+    def _graphics(self, vimbuffer, budget=None):
+        """Returns the pictures in the project of `vimbuffer'."""
+        reader = self._project.reader
+        snapshot = reader.update(self._project.stamps(), [vimbuffer.name])
+
+        def job():
+            with reader.use(snapshot):
+                return self._pics(vimbuffer.name)
 
-        p, subdirs, files = next(os.walk(path.dirname(vim.current.buffer.name)))
-        pics = [ pic for pic in files if pic[pic.rfind('.'):] in extensions ]
-        for d in subdirs:
-            files = os.listdir(path.join(p, d))
-            pics += [ path.join(d, pic) for pic in files if pic[pic.rfind('.'):] in extensions ] 
+        return self._worker.call('pics', job, budget, [])
 
-        return pics
+    def prewarm(self, vimbuffer):
+        """Starts indexing the project of `vimbuffer' in the background.
+
+        Later completions find the indexes ready. Only the buffers are
+        read on the main thread: the BibTeX and picture modules are
+        imported, kpsewhich is run and fonts are listed by the background
+        jobs. Errors are only logged: the user might not use BibTeX, for
+        example.
+        """
+
+        if not self._worker.threaded:
+            return
+
+        logging.debug("TeX-9: Indexing `{0}' in the background".format(vimbuffer.name))
+        try:
+            self._labels(vimbuffer, budget=0)
+            self._graphics(vimbuffer, budget=0)
+            dirname, bibfiles = self.get_bibfiles(vimbuffer)
+        except TeXNineError, e:
+            logging.debug("TeX-9: Stopped indexing: {0}".format(e))
+            return
+
+        def job():
+            # The paths are cached for get_bibpaths()
+            resolved = self._resolve_bibfiles(dirname, bibfiles)
+            return self._bibparser([p for p in resolved.values() if p])
+
+        self._worker.submit('bib', job)
+        self._worker.submit('fonts', self._fonts)
 
     def findstart(self, pat=re.compile(r'\\(\w+)(?:[(].+[)])?(?:[[].+[]])?{?')):
         """Finds the cursor position where completion starts."""
@@ -454,23 +776,31 @@ class TeXNineOmni(TeXNineBibTeX):
 
             return start 
 
-    def completions(self):
-        """Selects what type of omni completion should occur."""
+    def completions(self, base=""):
+        """Selects what type of omni completion should occur.
+
+        Waits for the background indexing at most
+        `g:tex_nine_config.worker_budget' milliseconds. Long lists are
+        filtered here by the prefix `base' to keep the menu small.
+        """
 
         compl = []
+        budget = config['worker_budget'] / 1000.0
 
         try:
             # Select completion based on keyword
             if self.keyword is not None:
                 # Natbib has \Cite.* type of of commands
                 if 'cite' in self.keyword or 'Cite' in self.keyword: 
-                    compl = self.bibentries
+                    compl = self.get_bibentries(budget)
                 elif 'ref' in self.keyword:
-                    compl = self._labels(vim.current.buffer)
+                    compl = self._labels(vim.current.buffer, budget)
                 elif 'font' in self.keyword or 'setmath' in self.keyword:
-                    compl = self._fonts()
+                    compl = self._worker.call('fonts', self._fonts, budget, [])
+                    compl = [f for f in compl if f.lower().startswith(base.lower())]
                 elif 'includegraphics' in self.keyword:
-                    compl = self._pics()
+                    compl = self._graphics(vim.current.buffer, budget)
+                    compl = load_module('tex_nine_graphics').prefixed(compl, base)
 
         except TeXNineError, e:
             echoerr("Omni completion failed: "+str(e))
@@ -481,47 +811,28 @@ class TeXNineOmni(TeXNineBibTeX):
 class TeXNineSnippets(object):
     """Snippet engine for TeX-9.
 
+    The snippets of a filetype are read from the file given to
+    setup_snippets() and the files found in
+    `g:tex_nine_config.snippet_dirs', which override it. They are
+    compiled by TeXNineSnippetStore on the first insertion.
     """
-    _snippets = {'tex': {}, 'bib': {}}
-
-    def _parser(self, string):
-        """Returns a 2-tuple with the snippet keyword and corresponding
-        snippet content."""
-
-        # String to list, preserving carriage returns
-        lines = string.splitlines(True) 
-
-        # Format the snippet 
-        lines = [ line.lstrip(' ') for line in lines if
-                 '#' not in line ]
-
-        if lines:
-            snippet = "".join(lines[1:]).rstrip('\n')
-            keyword = str(lines[0].rstrip('\n'))
-            return (keyword, snippet)
-        else:
-            return ()
+    _snipfiles = {}
+    _store = None
 
     def setup_snippets(self, fname, ft):
-        """Builds a dictionary of keyword-snippet pairs.
-
-        Extracts snippets out of ``fname'' whose syntax resembles that
-        of Michael Sander's snipMate plugin. Both BibTeX and LaTeX
-        buffers get their own dictionary.  
-        """
-
-        if self._snippets[ft]:
-            # We have the snippets already
-            return
-
-        logging.debug("TeX-9: Reading snippets from `{0}'.".format(path.basename(fname)))
-        with open(fname) as snipfile:
-
-            # Strip trailing empty lines
-            snippets = snipfile.read().rstrip('\n').split('snippet')
-            snippets = map(self._parser, snippets)
-            snippets = filter(None, snippets) # Remove comments
-            self._snippets[ft] = dict(snippets)
+        """Sets the snippet file of the filetype ``ft''. The file is read
+        on the first insertion."""
+        self._snipfiles[ft] = fname
+
+    def get_snippets(self, ft):
+        """Returns the snippets of the filetype ``ft'' as a dictionary."""
+        snippets = load_module('tex_nine_snippets')
+        if TeXNineSnippets._store is None:
+            cache = TeXNineCache('snippets', version=2) if config['cache'] else None
+            TeXNineSnippets._store = snippets.TeXNineSnippetStore(cache)
+        files = [self._snipfiles[ft]] if ft in self._snipfiles else []
+        files += snippets.snippet_files(config['snippet_dirs'], ft)
+        return self._store.table(ft, files)
 
     def insert_snippet(self, keyword, ft):
         """Inserts snippets into the current Vim buffer.
@@ -541,7 +852,7 @@ class TeXNineSnippets(object):
         """
 
         try:
-            snippet = self._snippets[ft][keyword]
+            snippet = self.get_snippets(ft)[keyword]
             snippet = "m`i"+snippet+"``"
         except KeyError:
             if ft == 'tex':
@@ -572,14 +883,33 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
     to also work in multi-file LaTeX projects.
     
     """
+    # Environment names keyed on filetype
+    _environments = {}
+    _syncreaders = {}
+    _initialised = False
+
     def __init__(self, vimbuffer,
                  date_label=config['_datelabel'],
                  timestr=config['_timestr']):
 
         TeXNineBase.add_buffer(self, vimbuffer)
+        # The instance is shared by all buffers: set up the state only
+        # once so that a running build survives opening another file
+        if self._initialised:
+            return
+        self._initialised = True
         self.date_label = date_label
         self.timestr = timestr
         self.biberrors = []
+        self.build = None
+        self.step = None
+        self.project_build = None
+        self.manifest = None
+        self.log = None
+        self.qflist = []
+        self.saved = None
+        self.pass_times = []
+        self.project = self._masters.project
 
     @TeXNineBase.multi_file
     def get_master_output(self, vimbuffer):
@@ -595,52 +925,409 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
 
     @TeXNineBase.multi_file
     def forward_search(self, vimbuffer, vimcurrent):
-        """Highligts current cursor position in Evince."""
+        """Highligts current cursor position in the PDF viewer.
 
-        if self.buffers[vimbuffer.name]['synctex'] is None:
-            try:
-                target = document.get_master_output(vimbuffer)
-                evince_proxy = tex_nine_synctex.TeXNineSyncTeX(target,
-                                                               logging) 
-                self.buffers[vimbuffer.name]['synctex'] = evince_proxy
-            except TeXNineError, NameError:
-                return
+        Evince is driven over DBus unless `g:tex_nine_config.sync_viewer'
+        is set or Evince cannot be used. Otherwise the position is looked
+        up in the SyncTeX file and `sync_viewer' is run, or the page is
+        shown if it is not set.
+        """
+
+        if self.buffers[vimbuffer.name]['synctex'] is None and not config['sync_viewer']:
+            synctex = load_synctex()
+            if synctex is not None:
+                try:
+                    target = document.get_master_output(vimbuffer)
+                    evince_proxy = synctex.get_proxy(target, logging)
+                    self.buffers[vimbuffer.name]['synctex'] = evince_proxy
+                except TeXNineError:
+                    return
 
         s = self.buffers[vimbuffer.name]['synctex']
         syncstr = "TeX-9: master={0}, row={1[0]}, col={1[1]}" 
         logging.debug(syncstr.format(vimbuffer.name,
                                      vimcurrent.window.cursor))
-        s.forward_search(vimcurrent.buffer.name, vimcurrent.window.cursor)
-        return
+        if s is not None and not config['sync_viewer']:
+            s.forward_search(vimcurrent.buffer.name, vimcurrent.window.cursor)
+            return
+
+        target = self.get_master_output(vimbuffer)
+        row = vimcurrent.window.cursor[0]
+        found = self.get_synctex_reader(target).forward(vimcurrent.buffer.name, row)
+        if found is None:
+            raise TeXNineError(messages['NO_SYNC'].format(
+                row, path.basename(vimcurrent.buffer.name)))
+        page, x, y = found
+        if config['sync_viewer']:
+            cmd = config['sync_viewer'].format(pdf=quote(target), page=page,
+                                               x=int(x), y=int(y))
+            load_module('subprocess').call(cmd+' &> /dev/null &', shell=True)
+        else:
+            echomsg("Line {0} is on page {1}.".format(row, page))
+
+    def get_synctex_reader(self, target):
+        """Returns the index of the SyncTeX file of the output file
+        `target', reading the file if it changed."""
+        reader = self._syncreaders.get(target)
+        if reader is None:
+            synctex_reader = load_module('tex_nine_synctex_reader')
+            reader = synctex_reader.TeXNineSyncTeXReader(target)
+            self._syncreaders[target] = reader
+        try:
+            reader.refresh()
+        except IOError:
+            raise TeXNineError(messages['NO_SYNCTEX'].format(path.basename(target)))
+        return reader
 
     @TeXNineBase.multi_file
-    def compile(self, vimbuffer, compiler):
-        """Compiles the current LaTeX manuscript updating the references.
+    def backward_search(self, vimbuffer, page, x=0, y=0):
+        """Jumps to the source of the position (`x', `y') on `page' of
+        the output file, given in big points from the top left corner."""
+
+        target = self.get_master_output(vimbuffer)
+        found = self.get_synctex_reader(target).backward(page, x, y)
+        if found is None:
+            echomsg("Nothing on page {0} comes from the sources.".format(page))
+            return
+        fname, row = found
+        fname = fname.replace(' ', '\\ ')
+        try:
+            vim.command('buffer {0}'.format(fname))
+        except vim.error:
+            vim.command('edit {0}'.format(fname))
+        row = min(row, len(vim.current.buffer))
+        vim.current.window.cursor = (row, 0)
+
+    @TeXNineBase.multi_file
+    def up_to_date(self, vimbuffer, compiler, deep, makeprg):
+        """Checks whether the last successful build can be reused.
+
+        Hashes the inputs of the project and compares them with the
+        build manifest. If nothing changed, the errors of the last build
+        are put in self.qflist and True is returned. Otherwise the
+        hashes are kept so that the next build can record them.
+        """
+
+        self.manifest = None
+        self.saved = None
+        self.pass_times = []
+        if not config['manifest']:
+            return False
+
+        master = vimbuffer.name
+        start = time.time()
+        tex_nine_build = load_module('tex_nine_build')
+        self.manifest = tex_nine_build.TeXNineManifest(master,
+                                                       self.project_inputs(master),
+                                                       (compiler, makeprg))
+        target = "{0}.{1}".format(master[:-len('.tex')], config['viewer']['target'])
+        up_to_date = self.manifest.up_to_date(deep, target)
+        logging.debug("TeX-9: Checked {0} inputs in {1:.3f} s".format(
+            len(self.manifest.inputs), time.time() - start))
+        if up_to_date:
+            logging.debug("TeX-9: `{0}' is up to date".format(target))
+            self.add_biberrors(self.manifest.data['errors'])
+            self.qflist = self.parse_output(path.dirname(master),
+                                            self.manifest.data['output'])
+        return up_to_date
+
+    def project_inputs(self, master):
+        """Returns the inputs of the project of `master' including the
+        BibTeX files that kpsewhich finds."""
+        return self.project.inputs(master, TeXNineOmni()._resolve_bibfiles)
+
+    def record_build(self, build):
+        """Notes the times of the LaTeX passes and the time the
+        precompiled preamble saved and updates the build manifest if
+        `build' succeeded."""
+        self.saved = build.saved_time()
+        self.pass_times = build.pass_times
+        if self.saved is not None:
+            logging.debug("TeX-9: The precompiled preamble saved {0:.2f} s".format(self.saved))
+        if self.manifest is not None and build.succeeded():
+            self.manifest.record(build.deep, build.output, build.errors)
+        self.manifest = None
+
+    @TeXNineBase.multi_file
+    def compile(self, vimbuffer, compiler, deep, makeprg):
+        """Compiles the current LaTeX manuscript.
+
+        A deep build updates the references running LaTeX, BibTeX and
+        makeindex as many times as needed. Returns the errors of the
+        last LaTeX pass as quickfix entries.
+        """
+
+        tex_nine_build = load_module('tex_nine_build')
+        build = tex_nine_build.TeXNineBuild(vimbuffer.name, compiler, deep, makeprg,
+                                            config['max_passes'],
+                                            preamble=self.get_preamble(vimbuffer.name, compiler),
+                                            draft=config['draft'])
+        output = build.run()
+        self.add_biberrors(build.errors)
+        self.record_build(build)
+        return self.parse_output(build.cwd, output)
+
+    def get_preamble(self, master, compiler):
+        """Returns the precompiled preamble of `master' if it is
+        enabled."""
+        if not config['preamble']:
+            return None
+        return load_module('tex_nine_build').TeXNinePreamble(master, compiler)
+
+    def report(self):
+        """Returns a note on the times of the LaTeX passes of the last
+        build if draft mode is enabled and on the time the precompiled
+        preamble saved, or an empty string."""
+        note = ""
+        if config['draft'] and self.pass_times:
+            times = ["{0:.2f} s{1}".format(t, " (draft)" if d else "")
+                     for t, d in self.pass_times]
+            note += " Passes: {0}.".format(", ".join(times))
+        if self.saved is not None:
+            note += " The precompiled preamble saved {0:.2f} s.".format(self.saved)
+        return note
+
+    def parse_output(self, cwd, output, filename=None):
+        """Returns the errors in the output of LaTeX and the BibTeX
+        errors as quickfix entries. BibTeX errors refer to `filename',
+        the current buffer by default."""
+        log = load_module('tex_nine_log').TeXNineLogParser(cwd, config['verbose'])
+        entries = log.feed(output.splitlines()) + log.close()
+        logging.debug("TeX-9: Found {0} error(s) and {1} warning(s)".format(
+            log.errors, log.warnings))
+        return entries + self.bibtex_entries(filename)
+
+    def bibtex_entries(self, filename=None):
+        """Returns the BibTeX errors as quickfix entries."""
+        filename = filename or vim.current.buffer.name
+        entries = [{'filename': filename, 'text': e,
+                    'lnum': 1, 'type': 'E'} for e in self.biberrors]
+        self.biberrors = []
+        return entries
+
+    def add_biberrors(self, errors):
+        for key, arg in errors:
+            if key == 'NO_BIBSTYLE':
+                self.biberrors.append("Cannot update BibTeX references: "+messages['NO_BIBSTYLE'])
+            else:
+                self.biberrors.append(messages[key].format(arg))
+
+    @TeXNineBase.multi_file
+    def start_build(self, vimbuffer, compiler, deep, makeprg):
+        """Starts an asynchronous build of the master file.
+
+        Vim runs the steps with its job control: next_step() returns the
+        next command and step_done() records its result. A build in
+        progress is cancelled.
+        """
+
+        self.cancel_build()
+        tex_nine_build = load_module('tex_nine_build')
+        self.build = tex_nine_build.TeXNineBuild(vimbuffer.name, compiler, deep, makeprg,
+                                                 config['max_passes'],
+                                                 preamble=self.get_preamble(vimbuffer.name, compiler),
+                                                 draft=config['draft'])
+        logging.debug("TeX-9: Starting a build of `{0}'".format(vimbuffer.name))
+
+    def next_step(self):
+        """Returns the next step of the build as a Vim dictionary or an
+        empty dictionary if the build is done."""
+        if self.build is None:
+            return {}
+        step = self.build.next_step()
+        if step is None:
+            self.add_biberrors(self.build.errors)
+            self.record_build(self.build)
+            self.build = None
+            return {}
+        self.step = step
+        if step['parse']:
+            tex_nine_log = load_module('tex_nine_log')
+            self.log = tex_nine_log.TeXNineLogParser(step['cwd'], config['verbose'])
+        return dict(name=step['name'], parse=step['parse'],
+                    cmd=['sh', '-c', load_module('tex_nine_build').shell_command(step)])
+
+    def _project_builds(self, vimbuffer, compiler, deep, makeprg):
+        """Prepares the builds of every master file whose project
+        contains `vimbuffer'.
+
+        The master files are looked up in the reverse include index,
+        which also covers the directory of the master file of
+        `vimbuffer'. Each master is built with its own compiler, in an
+        output directory of its own so that the .aux files of shared
+        chapters do not clash. Returns a 2-tuple (builds, results) where
+        `builds' lists the 2-tuples (build, manifest) of the masters to
+        build and `results' the 3-tuples (master, output, errors) of the
+        masters that are up to date.
+
+        Raises TeXNineError if no master file includes `vimbuffer'.
+        """
 
+        fname = vimbuffer.name
+        try:
+            root = path.dirname(self.get_master_file(vimbuffer))
+        except TeXNineError:
+            root = path.dirname(fname)
+        masters = self._masters.masters(fname, [root])
+        if not masters:
+            raise TeXNineError(messages['NO_MASTERS'].format(path.basename(fname)))
+
+        tex_nine_build = load_module('tex_nine_build')
+        results = []
+        builds = []
+        for master in masters:
+            with open(master) as f:
+                own = find_compiler(f.read().splitlines()) or compiler
+            mastermakeprg = makeprg if own == compiler else make_program(own)
+            manifest = tex_nine_build.TeXNineManifest(master, self.project_inputs(master),
+                                                      (own, mastermakeprg))
+            target = "{0}.{1}".format(master[:-len('.tex')], config['viewer']['target'])
+            if config['manifest'] and manifest.up_to_date(deep, target):
+                logging.debug("TeX-9: `{0}' is up to date".format(target))
+                results.append((master, manifest.data['output'],
+                                manifest.data['errors']))
+                continue
+            outdir = path.join(path.dirname(master), '.tex_nine',
+                               path.splitext(path.basename(master))[0])
+            build = tex_nine_build.TeXNineBuild(master, own, deep, mastermakeprg,
+                                                config['max_passes'], outdir,
+                                                draft=config['draft'])
+            build.make_outdir(self.project.walk(master))
+            builds.append((build, manifest))
+        return (builds, results)
+
+    def _project_qflist(self, builds, results):
+        """Publishes the output of the successful `builds' and returns
+        the errors of all masters as quickfix entries tagged with the
+        names of the masters."""
+
+        results = list(results)
+        for build, manifest in builds:
+            if build.succeeded():
+                build.publish()
+                if config['manifest']:
+                    manifest.record(build.deep, build.output, build.errors)
+            results.append((build.master, build.output, build.errors))
+
+        # The same message in a shared file is listed once
+        merged = OrderedDict()
+        for master, output, errors in results:
+            self.add_biberrors(errors)
+            entries = self.parse_output(path.dirname(master), output,
+                                        filename=master)
+            tag = path.splitext(path.basename(master))[0]
+            for e in entries:
+                key = (e['filename'], e['lnum'], e['type'], e['text'])
+                merged.setdefault(key, []).append(tag)
+
+        return [dict(filename=f, lnum=l, type=t,
+                     text="[{0}] {1}".format(", ".join(tags), text))
+                for (f, l, t, text), tags in merged.items()]
+
+    def compile_project(self, vimbuffer, compiler, deep, makeprg):
+        """Compiles every master file whose project contains `vimbuffer'
+        and returns the errors of all builds as quickfix entries.
+
+        The masters are built concurrently, at most config['jobs'] at a
+        time, and Vim waits for them; start_project_build() does the
+        same with Vim's job control. Masters that are up to date are not
+        built again.
+
+        Raises TeXNineError if no master file includes `vimbuffer'.
         """
 
-        cwd, basename = os.path.split(vimbuffer.name)
+        builds, results = self._project_builds(vimbuffer, compiler, deep, makeprg)
+        start = time.time()
+        jobs = config['jobs'] or load_module('multiprocessing').cpu_count()
+        load_module('tex_nine_build').run_builds([b for b, m in builds], jobs)
+        logging.debug("TeX-9: Built {0} master file(s) in {1:.2f} s".format(
+            len(builds), time.time() - start))
+        return self._project_qflist(builds, results)
+
+    def start_project_build(self, vimbuffer, compiler, deep, makeprg):
+        """Starts building every master file whose project contains
+        `vimbuffer' without blocking Vim.
 
-        tex_cmd = [compiler, '-output-directory='+cwd,
-                   '-interaction=batchmode', basename]
-        bib_cmd = ['bibtex', basename[:-len('.tex')]+'.aux']
-        kwargs = {'stdout': subprocess.PIPE, 'cwd': cwd}
+        Vim runs the steps as jobs: next_project_steps() returns the
+        commands to start, project_step_done() records their results and
+        finish_project_build() returns the errors when no step is left.
+        A project build in progress is cancelled.
 
-        subprocess.Popen(tex_cmd, **kwargs).wait()
-        stdout, stderr = subprocess.Popen(bib_cmd, **kwargs).communicate() 
+        Raises TeXNineError if no master file includes `vimbuffer'.
+        """
 
-        nobibstyle = re.search("found no \\\\bibstyle command",
-                               stdout)
-        matches = re.findall('I didn.t find a database entry for .(\S+).',
-                             stdout)
-        if nobibstyle:
-            self.biberrors.append("Cannot update BibTeX references: "+messages['NO_BIBSTYLE'])
+        self.cancel_project_build()
+        builds, results = self._project_builds(vimbuffer, compiler, deep, makeprg)
+        jobs = config['jobs'] or load_module('multiprocessing').cpu_count()
+        queue = load_module('tex_nine_build').TeXNineBuildQueue([b for b, m in builds], jobs)
+        self.project_build = (queue, builds, results)
+        logging.debug("TeX-9: Starting {0} build(s), {1} at a time".format(len(builds), jobs))
+
+    def next_project_steps(self):
+        """Returns the steps of the project build that can start now as
+        Vim dictionaries. The key 'id' identifies the step in
+        project_step_done()."""
+        if self.project_build is None:
+            return []
+        shell_command = load_module('tex_nine_build').shell_command
+        return [dict(id=i, name=step['name'], cmd=['sh', '-c', shell_command(step)])
+                for i, step in self.project_build[0].next_steps()]
+
+    def project_step_done(self, i, returncode, output):
+        """Records the result of the step `i' of the project build."""
+        if self.project_build is not None:
+            self.project_build[0].step_done(i, returncode, "\n".join(output))
+
+    def finish_project_build(self):
+        """Returns the errors of the finished project build as quickfix
+        entries."""
+        if self.project_build is None:
+            return []
+        queue, builds, results = self.project_build
+        self.project_build = None
+        return self._project_qflist(builds, results)
 
-        # BibTeX does not report the location where the undefined entries are :-(
-        for m in matches:
-            self.biberrors.append(messages['INVALID_BIBENTRY'].format(m))
+    def cancel_project_build(self):
+        if self.project_build is not None:
+            for build, manifest in self.project_build[1]:
+                build.cancel()
+            logging.debug("TeX-9: Cancelled the project build")
+            self.project_build = None
 
-        subprocess.Popen(tex_cmd, **kwargs).wait()
+    @TeXNineBase.multi_file
+    def server_command(self, vimbuffer, compiler, deep, makeprg):
+        """Returns the command that starts a build server for the master
+        file (see tex_nine_server.py)."""
+        server = path.join(config['_pypath'], 'tex_nine_server.py')
+        return [config['server_python'], server, vimbuffer.name, compiler,
+                makeprg, str(deep), str(config['server_interval']),
+                str(config['verbose'])]
+
+    def read_output(self, lines):
+        """Returns the quickfix entries completed by `lines', the latest
+        output of the running LaTeX pass."""
+        return self.log.feed(lines) if self.log else []
+
+    def step_done(self, returncode, output):
+        """Records the result of the running step. Returns the quickfix
+        entries that were still pending."""
+        if self.build is None:
+            # Cancelled while the step was running
+            return []
+        self.build.step_done(self.step, returncode, "\n".join(output))
+        entries = []
+        if self.log is not None:
+            entries = self.log.close()
+            logging.debug("TeX-9: Found {0} error(s) and {1} warning(s)".format(
+                self.log.errors, self.log.warnings))
+            self.log = None
+        return entries
+
+    def cancel_build(self):
+        if self.build is not None:
+            self.build.cancel()
+            logging.debug("TeX-9: Cancelled the build of `{0}'".format(self.build.master))
+            self.build = None
 
     def get_compiler(self, vimbuffer, update=False):
         """Returns the name of compiler in the current project.
@@ -665,22 +1352,6 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
             echoerr(messages['MASTER_NOT_ACTIVE'].format(master))
             return ""
 
-    def postmake(self, ignored=re.compile('Overfull|Underfull')):
-        """Filters invalid and irrelevant error messages that LaTeX
-        compilers produce. Adds BibTeX errors. Relies on Vim's Quickfix mechanism.
-        """
-
-        valid_entry = lambda x: int(x['valid']) and not ignored.search(x['text'])
-        qflist = filter(valid_entry, vim.eval('getqflist()'))
-
-        # Add BibTeX errors
-        while self.biberrors:
-            qflist.append({'filename': vim.current.buffer.name,
-                           'text': self.biberrors.pop(),
-                           'lnum': "1"})
-
-        return qflist
-
     def view(self, vimbuffer):
         """Launches the viewer application.
 
@@ -692,7 +1363,7 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
         try:
             output = self.get_master_output(vimbuffer)
             cmd = '{0} "{1}" &> /dev/null &'.format(config['viewer']['app'], output)
-            subprocess.call(cmd, shell=True)
+            load_module('subprocess').call(cmd, shell=True)
         except TeXNineError, e:
             echoerr("Cannot determine the output file: "+str(e))
 
@@ -703,7 +1374,7 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
             template = Template(skeleton.read())
             skeleton = template.safe_substitute(_file = path.basename(vimbuffer.name),
                                                 _date_created = strftime(self.timestr),
-                                                _author = getuser())
+                                                _author = load_module('getpass').getuser())
 
             vimbuffer[:] = skeleton.splitlines(True)
 
@@ -742,6 +1413,38 @@ class TeXNineDocument(TeXNineBase, TeXNineSnippets):
         if paths:
             echomsg(messages["INVALID_BIBENTRY"].format(cword))
 
+    def update_environments(self, vimbuffer, dictionary, ft):
+        """Updates the index of environment names of the filetype `ft'.
+
+        The names are the words in the file `dictionary', which is read
+        once, the keywords of the snippets of `ft' and, in LaTeX files,
+        the environments defined in the project of `vimbuffer' and its
+        local packages. Only files that changed are scanned again.
+        """
+
+        index = self._environments.setdefault(ft, TeXNineWordIndex())
+        if 'dictionary' not in index:
+            words = []
+            try:
+                with open(dictionary.split(',')[0]) as f:
+                    words = f.read().split()
+            except IOError, e:
+                logging.debug("TeX-9: Cannot read the dictionary: {0}".format(e))
+            index.update('dictionary', words)
+        index.update('snippets', self.get_snippets(ft).keys())
+        if ft == 'tex':
+            try:
+                master = self.get_master_file(vimbuffer)
+                index.update('project', self.project.environments(master))
+            except TeXNineError, e:
+                logging.debug("TeX-9: Cannot find the environments of the project: {0}".format(e))
+
+    def complete_environments(self, base, ft):
+        """Returns the environment names of the filetype `ft' that start
+        with `base'."""
+        return self._environments.setdefault(ft, TeXNineWordIndex()).complete(base)
+
+startup_times.append(("pyfile __init__.py", 1000*(time.time() - _started)))
 logging.debug("TeX-9: Done with the Python module.")
 
 # vim: tw=72 fdm=indent fdn=1
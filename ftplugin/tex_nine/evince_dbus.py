@@ -27,6 +27,8 @@
 ############################
 
 import dbus
+import time
+from collections import deque
 
 RUNNING, CLOSED = range(2)
 
@@ -52,6 +54,10 @@ class EvinceWindowProxy:
         self.source_handler = None
         self.dbus_name = ''
         self._handler = None
+        self._signals = []
+        self._window_signals = []
+        # Milliseconds of the latest SyncView round trips
+        self.latencies = deque(maxlen=100)
         try:
             if EvinceWindowProxy.bus is None:
                 EvinceWindowProxy.bus = dbus.SessionBus()
@@ -60,9 +66,10 @@ class EvinceWindowProxy:
                 EvinceWindowProxy.daemon = EvinceWindowProxy.bus.get_object(EV_DAEMON_NAME,
                                                 EV_DAEMON_PATH,
                                                 follow_name_owner_changes=True)
-            EvinceWindowProxy.bus.add_signal_receiver(self._on_doc_loaded, signal_name="DocumentLoaded", 
-                                                      dbus_interface = EV_WINDOW_IFACE, 
-                                                      sender_keyword='sender')
+            self._signals.append(
+                EvinceWindowProxy.bus.add_signal_receiver(self._on_doc_loaded, signal_name="DocumentLoaded", 
+                                                          dbus_interface = EV_WINDOW_IFACE, 
+                                                          sender_keyword='sender'))
             self._get_dbus_name(False)
 
         except dbus.DBusException:
@@ -104,8 +111,10 @@ class EvinceWindowProxy:
         if len(window_list) > 0:
             window_obj = EvinceWindowProxy.bus.get_object(self.dbus_name, window_list[0])
             self.window = dbus.Interface(window_obj,EV_WINDOW_IFACE)
-            self.window.connect_to_signal("Closed", self.on_window_close)
-            self.window.connect_to_signal("SyncSource", self.on_sync_source)
+            self._remove_window_signals()
+            self._window_signals = [
+                self.window.connect_to_signal("Closed", self.on_window_close),
+                self.window.connect_to_signal("SyncSource", self.on_sync_source)]
         else:
             #That should never happen. 
             if self._log:
@@ -115,10 +124,30 @@ class EvinceWindowProxy:
     def set_source_handler (self, source_handler):
         self.source_handler = source_handler
 
+    def _remove_window_signals(self):
+        for match in self._window_signals:
+            match.remove()
+        self._window_signals = []
+
     def on_window_close(self):
+        self._remove_window_signals()
         self.window = None
         self.status = CLOSED
 
+    def close(self):
+        """Removes all signal receivers of the proxy."""
+        self._remove_window_signals()
+        for match in self._signals:
+            match.remove()
+        self._signals = []
+
+    def _sync_view(self, input_file, data, time_):
+        start = time.time()
+        self.window.SyncView(input_file, data, time_, dbus_interface = EV_WINDOW_IFACE)
+        self.latencies.append(1000*(time.time() - start))
+        if self._log:
+            self._log.debug("SyncView took {0:.1f} ms".format(self.latencies[-1]))
+
     def on_sync_source(self, input_file, source_link, timestamp):
         if self.source_handler is not None:
             self.source_handler(input_file, source_link, timestamp)
@@ -130,7 +159,7 @@ class EvinceWindowProxy:
                 self._handler = self._syncview_handler
                 self._get_dbus_name(True)
         else:
-            self.window.SyncView(input_file, data, time,  dbus_interface = "org.gnome.evince.Window")
+            self._sync_view(input_file, data, time)
 
     def _syncview_handler(self, window_list):
         self.handle_get_window_list_reply(window_list)
@@ -139,10 +168,9 @@ class EvinceWindowProxy:
             return False
 
         try:
-            self.window.SyncView(self._tmp_syncview[0],
-                                 self._tmp_syncview[1],
-                                 self._tmp_syncview[2],
-                                 dbus_interface="org.gnome.evince.Window")
+            self._sync_view(self._tmp_syncview[0],
+                            self._tmp_syncview[1],
+                            self._tmp_syncview[2])
             del self._tmp_syncview
             self._handler = None
             return True
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Keeps an index of BibTeX entries per database. A database is parsed
+# only when its modification time or size differs from the last time
+# it was read. The index may be backed by a persistent cache so that a
+# new Vim session does not need to parse the databases again. Does not
+# depend on Vim.
+
+import re
+import os
+import time
+import logging
+import subprocess
+
+# Entry types that do not define citekeys
+NON_ENTRIES = ('string', 'comment', 'preamble')
+
+def kpsewhich(names):
+    """Looks up files in the TeX tree with a single call to kpsewhich.
+
+    Returns a dictionary that maps each name in `names' to its absolute
+    path. Names that kpsewhich cannot find are left out.
+
+    * Requires the program ``kpsewhich''
+    that is shipped with the standard TeXLive distribution.
+    """
+
+    if not names:
+        return {}
+
+    proc = subprocess.Popen(['kpsewhich', '-must-exist'] + list(names),
+                            stdout=subprocess.PIPE)
+    found = proc.communicate()[0].splitlines()
+
+    # kpsewhich prints the paths of the files it finds in the order of
+    # the arguments but skips the missing ones.
+    resolved = {}
+    for name in names:
+        for i, p in enumerate(found):
+            if os.path.basename(p) == os.path.basename(name):
+                resolved[name] = found.pop(i)
+                break
+    return resolved
+
+def _match_close(text, start, close):
+    """Returns the index of the delimiter `close' that ends the entry
+    whose body starts at `start' or -1. Braces must balance in between;
+    a parenthesis closes the entry only outside of braces."""
+
+    depth = 0
+    for i in xrange(start, len(text)):
+        c = text[i]
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            if depth == 0:
+                return i if close == '}' else -1
+            depth -= 1
+        elif c == close and depth == 0:
+            return i
+    return -1
+
+def _scan_value(text, i, end, word_pat=re.compile(r'[^\s,#{}"]+')):
+    """Reads the field value that starts at `text[i]'. Braced and quoted
+    parts, numbers and macros can be concatenated with `#'. Returns the
+    value and the index after it."""
+
+    parts = []
+    while i < end:
+        c = text[i]
+        if c in '{"':
+            depth = 0
+            j = i + 1
+            while j < end:
+                if text[j] == '{':
+                    depth += 1
+                elif text[j] == '}':
+                    if depth == 0:
+                        # Closes the braced value
+                        break
+                    depth -= 1
+                elif text[j] == '"' and c == '"' and depth == 0:
+                    break
+                j += 1
+            parts.append(text[i+1:j])
+            i = j + 1
+        else:
+            m = word_pat.match(text, i, end)
+            if m is None:
+                break
+            parts.append(m.group(0))
+            i = m.end()
+        while i < end and text[i].isspace():
+            i += 1
+        if i < end and text[i] == '#':
+            i += 1
+            while i < end and text[i].isspace():
+                i += 1
+            continue
+        break
+    value = ''.join(parts).replace('{', '').replace('}', '')
+    return ' '.join(value.split()), i
+
+def parse_bibfile(fname,
+                  entry_pat=re.compile(r'@\s*(\w+)\s*([{(])'),
+                  next_entry_pat=re.compile(r'^[ \t]*@', re.M),
+                  key_pat=re.compile(r'\s*([^,\s{}()]*)\s*'),
+                  field_pat=re.compile(r'[\s,]*([^\s=,{}"#]+)\s*=\s*')):
+    """Extracts BibTeX entries out of file `fname'.
+
+    The whole file is scanned: fields and citekeys may span lines and
+    values may contain nested braces. An entry whose braces do not
+    balance ends where the next line starting with `@' begins. Returns a
+    list of 4-tuples (key, title, author, year) where missing fields are
+    empty strings.
+
+    Raises IOError if the file cannot be read.
+
+    """
+
+    with open(fname) as f:
+        text = f.read()
+
+    entries = []
+    pos = 0
+    while True:
+        m = entry_pat.search(text, pos)
+        if m is None:
+            break
+        start = m.end()
+        end = _match_close(text, start, '}' if m.group(2) == '{' else ')')
+        if end == -1:
+            n = next_entry_pat.search(text, start)
+            end = n.start() if n else len(text)
+        pos = end
+
+        if m.group(1).lower() in NON_ENTRIES:
+            continue
+
+        k = key_pat.match(text, start, end)
+        if not k.group(1):
+            continue
+        fields = {}
+        i = k.end()
+        while i < end:
+            f = field_pat.match(text, i, end)
+            if f is None:
+                break
+            value, i = _scan_value(text, f.end(), end)
+            fields[f.group(1).lower()] = value
+        entries.append((k.group(1),) + tuple(fields.get(name, '')
+                                             for name in ('title', 'author', 'year')))
+
+    return entries
+
+class TeXNineBibIndex(object):
+    """Per-file index of BibTeX entries.
+
+    Each database is stored as a 3-tuple (mtime, size, entries) keyed on
+    its absolute path. Call refresh() with a list of paths to reparse
+    the databases that changed and entries() to get all entries in the
+    order of the paths.
+
+    If `cache' (a TeXNineCache object) is given, the index is read from
+    it on the first refresh() and written back whenever a database was
+    reparsed. The databases in the index hold at most `max_entries'
+    entries together, so that one huge database weighs more than many
+    small ones; the databases that were used least recently are evicted
+    first, but never the ones of the latest refresh().
+
+    """
+
+    def __init__(self, cache=None, max_entries=20000):
+        self._files = {}
+        self._used = {}
+        self._cache = cache
+        self._loaded = cache is None
+        self.max_entries = max_entries
+
+    def _stat(self, fname):
+        st = os.stat(fname)
+        return (st.st_mtime, st.st_size)
+
+    def _load(self):
+        self._loaded = True
+        data = self._cache.load()
+        if data:
+            # Entries parsed in this session win
+            data['files'].update(self._files)
+            data['used'].update(self._used)
+            self._files, self._used = data['files'], data['used']
+
+    def _evict(self, keep):
+        for fname in self._files.keys():
+            if not os.path.exists(fname):
+                self.discard(fname)
+        total = sum(len(r[2]) for r in self._files.values())
+        lru = sorted(self._files, key=lambda f: self._used.get(f, 0))
+        for fname in lru:
+            if total <= self.max_entries:
+                break
+            if fname not in keep:
+                total -= len(self._files[fname][2])
+                self.discard(fname)
+
+    def _save(self, keep):
+        self._evict(keep)
+        self._cache.save({'files': self._files, 'used': self._used})
+
+    def is_fresh(self, fname):
+        """Returns True if `fname' is indexed and unchanged on disk."""
+        record = self._files.get(fname)
+        if record is None:
+            return False
+        try:
+            return record[:2] == self._stat(fname)
+        except OSError:
+            return False
+
+    def refresh(self, paths):
+        """Reparses the databases in `paths' that changed on disk.
+
+        Returns the list of paths that were reparsed. Raises IOError if
+        a database cannot be read.
+
+        """
+
+        if not self._loaded:
+            self._load()
+
+        changed = []
+        now = time.time()
+        try:
+            for fname in paths:
+                self._used[fname] = now
+                if self.is_fresh(fname):
+                    continue
+                try:
+                    stamp = self._stat(fname)
+                except OSError, e:
+                    raise IOError(str(e))
+                logging.debug("TeX-9: Reading BibTeX entries from `{0}'".format(os.path.basename(fname)))
+                self._files[fname] = stamp + (parse_bibfile(fname),)
+                changed.append(fname)
+        finally:
+            if changed and self._cache is not None:
+                self._save(paths)
+        return changed
+
+    def entries(self, paths):
+        """Returns the indexed entries of the databases in `paths'."""
+        result = []
+        for fname in paths:
+            record = self._files.get(fname)
+            if record is not None:
+                result += record[2]
+        return result
+
+    def discard(self, fname):
+        self._files.pop(fname, None)
+        self._used.pop(fname, None)
+
+    def clear(self):
+        self._files.clear()
+        self._used.clear()
+        if self._cache is not None:
+            self._cache.clear()
+
+    def info(self):
+        """Returns a list of 2-tuples (path, number of entries)."""
+        if not self._loaded:
+            self._load()
+        return [(f, len(r[2])) for f, r in sorted(self._files.items())]
+
+def format_entry(entry):
+    """Turns an indexed entry into a Vim completion item."""
+    key, title, author, year = entry
+    authors = author.split(' and ')
+    name = authors[0]
+    name = name.split(',')[0] if ',' in name else name.split(' ')[-1]
+    if len(authors) > 1:
+        name += ' et al.'
+    menu = " ".join(filter(None, [name, year and '({0})'.format(year)]))
+    return dict(word=key, menu=menu, info=title)
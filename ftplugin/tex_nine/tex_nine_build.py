@@ -0,0 +1,729 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNineBuild that describes the compilation of a master file
+# as a sequence of steps (LaTeX passes, BibTeX...). The caller asks for
+# the next step, runs it however it likes (synchronously or with Vim's
+# job control) and reports back; the next steps are decided from the
+# results. TeXNineManifest remembers the inputs of the last successful
+# build so that a build can be skipped when nothing changed,
+# TeXNinePreamble precompiles the preamble of a master file,
+# run_builds() runs several builds concurrently and TeXNineBuildQueue
+# hands out the steps of several builds to a caller that runs them
+# concurrently. Does not depend on Vim.
+
+import re
+import os
+import os.path as path
+import subprocess
+import logging
+import time
+import hashlib
+import shutil
+import threading
+import Queue
+from pipes import quote
+
+from tex_nine_cache import TeXNineCache
+
+def bibtex_errors(output):
+    """Returns the errors found in BibTeX's output.
+
+    The errors are 2-tuples (message key, argument).
+    """
+    errors = []
+    if re.search("found no \\\\bibstyle command", output):
+        errors.append(('NO_BIBSTYLE', None))
+    # BibTeX does not report the location where the undefined entries are :-(
+    for m in re.findall('I didn.t find a database entry for .(\S+).', output):
+        errors.append(('INVALID_BIBENTRY', m))
+    return errors
+
+def shell_command(step):
+    """Returns `step' as a command for the shell that runs in the
+    directory of the step."""
+    return 'cd {0} && exec {1}'.format(quote(step['cwd']),
+                                       ' '.join(map(quote, step['args'])))
+
+# Auxiliary files that LaTeX reads back in the next pass
+AUX_EXTENSIONS = ('.aux', '.toc', '.lof', '.lot', '.out', '.nav', '.snm',
+                  '.idx', '.glo')
+
+def file_hash(fname):
+    """Returns the MD5 hex digest of `fname' or None if it does not
+    exist."""
+    try:
+        with open(fname, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except IOError:
+        return None
+
+def aux_files(cwd, jobname):
+    """Returns the .aux files of a project: the main one and the ones
+    of \\include'd files."""
+    main = path.join(cwd, jobname+'.aux')
+    files = [main]
+    try:
+        with open(main) as f:
+            for line in f:
+                m = re.match(r'\\@input{([^}]+)}', line)
+                if m:
+                    files.append(path.join(cwd, m.group(1)))
+    except IOError:
+        pass
+    return files
+
+def recorder_inputs(fls, system=('/texmf', '/texlive/')):
+    """Returns the files that LaTeX read according to the .fls file
+    that `-recorder' writes.
+
+    Files that LaTeX also wrote (.aux...) and files in the TeX trees,
+    i.e. paths that contain one of `system', are left out.
+    """
+
+    inputs = []
+    outputs = set([])
+    cwd = path.dirname(fls)
+    try:
+        with open(fls) as f:
+            for line in f:
+                kind, _, fname = line.rstrip('\n').partition(' ')
+                if kind == 'PWD':
+                    cwd = fname
+                elif kind in ('INPUT', 'OUTPUT'):
+                    fname = path.normpath(path.join(cwd, fname))
+                    if kind == 'OUTPUT':
+                        outputs.add(fname)
+                    elif fname not in inputs:
+                        inputs.append(fname)
+    except IOError:
+        return []
+    return [f for f in inputs if f not in outputs
+            and not any(s in f for s in system)]
+
+# LaTeX could not load the format or it does not fit the engine
+FORMAT_ERROR_PAT = re.compile(r"can't find the format file|Fatal format file error"
+                              r"|\.fmt (?:was written by|doesn't match)")
+
+# Packages that do not survive a format dump
+UNDUMPABLE_PAT = re.compile(r'\\(?:usepackage|RequirePackage)\s*(?:\[[^]]*\]\s*)?'
+                            r'{[^}]*\b(?:fontspec|unicode-math|polyglossia|hyperref)\b')
+
+class TeXNinePreamble(object):
+    """The precompiled preamble of a master file.
+
+    The preamble, everything before \\begin{document}, is dumped with
+    mylatexformat into the format <jobname>-preamble.fmt next to the
+    master file. A build uses the format if it was dumped from the
+    current preamble; otherwise the build dumps it after the last LaTeX
+    pass. Preambles that cannot be dumped (LuaLaTeX, fontspec,
+    hyperref...) and preambles whose dump failed are not precompiled.
+
+    The digest covers the preamble and the local packages and classes it
+    loaded, as listed by -recorder when the format was dumped, so that
+    editing a .sty next to the master file dumps the format again. The
+    record keeps the digest, these inputs and the time of a LaTeX pass
+    with and without the format as an exponential moving average that
+    halves the weight of the older passes. It is kept in the user cache
+    directory under the digest of the path of the master file, like the
+    manifest, and written once at the end of a build.
+
+    """
+
+    def __init__(self, master, compiler):
+        self.master = master
+        self.compiler = compiler
+        self.cwd, basename = path.split(master)
+        jobname = path.splitext(basename)[0]
+        self.name = jobname+'-preamble'
+        self.cache = TeXNineCache('preamble-'+hashlib.md5(master).hexdigest())
+        self.data = self.cache.load() or {}
+        self._dirty = False
+        self.digest = self.hash()
+
+    def hash(self):
+        """Returns the digest of the preamble or None if it cannot be
+        dumped."""
+        if self.compiler not in ('latex', 'pdflatex', 'xelatex'):
+            return None
+        lines = []
+        try:
+            with open(self.master) as f:
+                for line in f:
+                    if '\\begin{document}' in line:
+                        break
+                    lines.append(line)
+                else:
+                    return None
+        except IOError:
+            return None
+        preamble = "".join(lines)
+        code = re.sub(r'(?<!\\)%.*', '', preamble)
+        if preamble.startswith('%&') or UNDUMPABLE_PAT.search(code):
+            logging.debug("TeX-9: Cannot precompile the preamble of `{0}'".format(self.master))
+            return None
+        inputs = "".join("{0}:{1}\n".format(f, file_hash(f))
+                         for f in self.data.get('inputs', []))
+        return hashlib.md5(self.compiler+preamble+inputs).hexdigest()
+
+    @property
+    def filename(self):
+        return path.join(self.cwd, self.name+'.fmt')
+
+    def usable(self):
+        return self.digest is not None and self.data.get('failed') != self.digest
+
+    def fresh(self):
+        """Returns True if the format was dumped from the current
+        preamble."""
+        return (self.usable() and self.data.get('digest') == self.digest
+                and path.exists(self.filename))
+
+    def format_step(self):
+        args = [self.compiler, '-ini', '-interaction=nonstopmode', '-recorder',
+                '-jobname='+self.name, '&'+self.compiler,
+                'mylatexformat.ltx', path.basename(self.master)]
+        return dict(name='format', args=args, cwd=self.cwd, parse=0)
+
+    def format_done(self, returncode):
+        if returncode == 0 and path.exists(self.filename):
+            # The master file counts only up to \begin{document}
+            fls = path.join(self.cwd, self.name+'.fls')
+            self.data['inputs'] = [f for f in recorder_inputs(fls)
+                                   if f != path.normpath(self.master)]
+            self.digest = self.hash()
+            self.data['digest'] = self.digest
+            self.data.pop('failed', None)
+        else:
+            logging.debug("TeX-9: Dumping the preamble of `{0}' failed".format(self.master))
+            self.data['failed'] = self.digest
+        self._dirty = True
+
+    def record_pass(self, with_format, seconds):
+        """Updates the moving average of the time of a LaTeX pass."""
+        key = 'fast' if with_format else 'plain'
+        moving = self.data.get(key)
+        self.data[key] = seconds if moving is None else (moving + seconds)/2
+        self._dirty = True
+
+    def save(self):
+        """Writes the record if it changed."""
+        if self._dirty:
+            self.cache.save(self.data)
+            self._dirty = False
+
+    def saved(self, passes):
+        """Returns the estimated time the format saves in `passes' LaTeX
+        passes or None if it is not known."""
+        if 'plain' in self.data and 'fast' in self.data:
+            return passes*(self.data['plain'] - self.data['fast'])
+        return None
+
+# Options that make a LaTeX pass skip writing the PDF
+DRAFT_OPTIONS = {
+    'pdflatex': '-draftmode',
+    'lualatex': '-draftmode',
+    'xelatex': '-no-pdf',
+}
+
+# Inputs of BibTeX, Biber and makeindex at the time they last ran
+# successfully, keyed on (master, output directory, tool)
+_tool_inputs = {}
+
+# The highest exit status of a tool that still wrote its output: BibTeX
+# exits with 1 after warnings such as undefined citations
+TOOL_WARNINGS = {'bibtex': 1}
+
+# Absolute paths of the BibTeX databases, keyed on (directory, name)
+_bibpaths = {}
+
+def find_bibfiles(directory, names):
+    """Returns the absolute paths of the BibTeX databases `names' as
+    BibTeX finds them: in `directory' first and then with kpsewhich.
+    Databases that cannot be found are left out."""
+
+    names = [n.strip() if n.strip().endswith('.bib') else n.strip()+'.bib'
+             for n in names if n.strip()]
+    missing = []
+    for name in names:
+        bibpath = _bibpaths.get((directory, name))
+        if bibpath and path.exists(bibpath):
+            continue
+        local = path.join(directory, name)
+        if path.exists(local):
+            _bibpaths[(directory, name)] = local
+        else:
+            missing.append(name)
+    if missing:
+        from tex_nine_bibtex import kpsewhich
+        for name, bibpath in kpsewhich(missing).items():
+            _bibpaths[(directory, name)] = bibpath
+    return [_bibpaths[(directory, n)] for n in names if (directory, n) in _bibpaths]
+
+class TeXNineBuild(object):
+    """The compilation of a master file.
+
+    `makeprg' is the value of Vim's 'makeprg' option; LaTeX passes run it
+    with `$*' replaced by the name of the master file so that the output
+    of the last pass can be turned into quickfix entries.
+
+    If `outdir' is given, LaTeX and the other tools write their files
+    there instead of the directory of the master file, and publish()
+    copies the output next to the master file. If `recorder' is set,
+    LaTeX lists the files it reads in the .fls file; see inputs().
+    `preamble' is a TeXNinePreamble or None.
+
+    If `draft' is set and the compiler has an option in DRAFT_OPTIONS,
+    the passes of a deep build that are followed by another pass run in
+    draft mode, without writing the PDF. A pass is expected to be
+    followed by another one if it is the first pass of a build from
+    scratch or if BibTeX (or Biber) or makeindex runs after it. If the
+    auxiliary files turn out to be stable after a draft pass, one more
+    pass writes the PDF. `pass_times' lists the 2-tuples (seconds,
+    draft) of the LaTeX passes.
+
+    A deep build schedules the passes according to the auxiliary files:
+    after every LaTeX pass the files are hashed; BibTeX (or Biber) and
+    makeindex run only when their inputs changed since they last ran,
+    and LaTeX is run again until the auxiliary files stop changing, but
+    at most `max_passes' times.
+
+    Each step is a dictionary with the keys
+
+    'name': 'latex', 'bibtex', 'biber', 'makeindex' or 'make'
+    'args': the command as a list of arguments
+    'cwd': the directory where the command is run
+    'parse': 1 for the steps whose output contains LaTeX errors
+    'draft': 1 for LaTeX passes in draft mode
+
+    `products' is the set of files that BibTeX, Biber and makeindex wrote
+    for LaTeX to read. Within a build a tool runs at most once for the
+    same inputs, whether it succeeded or not.
+
+    """
+
+    def __init__(self, master, compiler, deep, makeprg, max_passes=5,
+                 outdir=None, recorder=False, preamble=None, draft=False):
+        self.master = master
+        self.compiler = compiler
+        self.makeprg = makeprg
+        self.deep = deep and compiler != 'make'
+        self.max_passes = max_passes
+        self.cwd, self.basename = path.split(master)
+        self.outdir = outdir if outdir and compiler != 'make' else self.cwd
+        self.recorder = recorder and compiler != 'make'
+        if preamble is None or compiler == 'make' or not preamble.usable():
+            preamble = None
+        self.preamble = preamble
+        self.fmt = preamble.name if preamble and preamble.fresh() else None
+        self.fmt_passes = 0
+        self.draft = None
+        if draft and self.deep:
+            self.draft = DRAFT_OPTIONS.get(path.basename(compiler))
+        self._dumped = False
+        self.jobname = path.splitext(self.basename)[0]
+        self.errors = []
+        self.timings = []
+        self.pass_times = []
+        self.passes = 0
+        self.returncode = None
+        self.output = ""
+        self.cancelled = False
+        self._started = None
+        self._pending = {}
+        self._ran = {}
+        self.products = set([])
+        self._aux = self.aux_hashes()
+
+        if compiler == 'make':
+            self._steps = [self.make_step()]
+        else:
+            # Without an .aux file another pass will follow
+            self._steps = [self.latex_step(not path.exists(self._path('.aux')))]
+
+    def _path(self, ext):
+        return path.join(self.outdir, self.jobname+ext)
+
+    def aux_hashes(self):
+        files = aux_files(self.outdir, self.jobname)
+        files += [self._path(ext) for ext in AUX_EXTENSIONS if ext != '.aux']
+        return dict((f, file_hash(f)) for f in files)
+
+    def latex_step(self, draft=False):
+        """Returns a LaTeX pass, in draft mode if `draft' is set and the
+        pass is not the last one allowed."""
+        draft = draft and self.draft and self.passes + 1 < self.max_passes
+        args = quote(self.basename)
+        if draft:
+            args = '{0} {1}'.format(self.draft, args)
+        if self.recorder:
+            args = '-recorder '+args
+        if self.fmt:
+            args = '-fmt={0} {1}'.format(quote(self.fmt), args)
+        if self.outdir != self.cwd:
+            args = '-output-directory={0} {1}'.format(quote(self.outdir), args)
+        cmd = self.makeprg.replace('$*', args)
+        return dict(name='latex', args=['sh', '-c', cmd], cwd=self.cwd, parse=1,
+                    draft=int(bool(draft)))
+
+    def make_step(self):
+        cmd = self.makeprg.replace('$*', '')
+        return dict(name='make', args=['sh', '-c', cmd], cwd=self.cwd, parse=1)
+
+    def tool_steps(self):
+        """Returns the BibTeX, Biber and makeindex steps whose inputs
+        changed since they last ran."""
+
+        tools = []
+        bcf = self._path('.bcf')
+        if path.exists(bcf):
+            tools.append(('biber', [file_hash(bcf)],
+                          ['biber', '--output-directory', self.outdir,
+                           self.jobname]))
+        else:
+            # Only the lines that BibTeX reads matter
+            lines = []
+            for aux in aux_files(self.outdir, self.jobname):
+                try:
+                    with open(aux) as f:
+                        lines += [l for l in f if l.startswith(('\\citation',
+                                                                '\\bibdata',
+                                                                '\\bibstyle'))]
+                except IOError:
+                    pass
+            if any(l.startswith('\\bibdata') for l in lines):
+                bibs = re.findall(r'\\bibdata{([^}]+)}', "".join(lines))
+                bibs = find_bibfiles(self.cwd, ",".join(bibs).split(','))
+                stamps = [(b, file_hash(b)) for b in bibs]
+                digest = hashlib.md5("".join(lines)).hexdigest()
+                tools.append(('bibtex', [digest] + stamps,
+                              ['bibtex', self.jobname+'.aux']))
+
+        idx = self._path('.idx')
+        if path.exists(idx):
+            tools.append(('makeindex', [file_hash(idx)],
+                          ['makeindex', self.jobname+'.idx']))
+
+        steps = []
+        for name, inputs, args in tools:
+            output = self._path('.ind' if name == 'makeindex' else '.bbl')
+            if self._ran.get(name) == inputs:
+                logging.debug("TeX-9: Skipping `{0}': it already ran on these inputs".format(name))
+                continue
+            if _tool_inputs.get((self.master, self.outdir, name)) == inputs and path.exists(output):
+                logging.debug("TeX-9: Skipping `{0}': inputs did not change".format(name))
+                continue
+            # Remembered in step_done() if the tool succeeds
+            self._pending[name] = inputs
+            self.products.add(output)
+            cwd = self.cwd
+            if name != 'biber' and self.outdir != self.cwd:
+                # BibTeX and makeindex write next to their input; the
+                # .bib and .bst files are still found next to the master
+                cwd = self.outdir
+                search = '{0}:'.format(self.cwd)
+                args = ['env', 'BIBINPUTS='+search, 'BSTINPUTS='+search] + args
+            steps.append(dict(name=name, args=args, cwd=cwd, parse=0))
+        return steps
+
+    def schedule(self, draft=False):
+        """Decides what to run after a LaTeX pass. `draft' tells whether
+        the pass ran in draft mode."""
+        if not self.deep:
+            return
+
+        aux = self.aux_hashes()
+        tools = self.tool_steps()
+        if tools:
+            # The references settle only in the pass after the next one
+            self._steps = tools + [self.latex_step(True)]
+        elif aux == self._aux:
+            logging.debug("TeX-9: Auxiliary files are stable after {0} pass(es)".format(self.passes))
+        elif self.passes >= self.max_passes:
+            logging.debug("TeX-9: Giving up after {0} passes".format(self.passes))
+        else:
+            self._steps = [self.latex_step()]
+        self._aux = aux
+
+        if self.passes >= self.max_passes:
+            # No pass would read what the tools write
+            self._steps = []
+        if draft and not any(s['name'] == 'latex' for s in self._steps):
+            # The last pass did not write the PDF
+            self._steps.append(self.latex_step())
+
+    def next_step(self):
+        """Returns the next step or None if the build is done."""
+        if self.cancelled:
+            return None
+        if not self._steps and self.preamble and not self.fmt and not self._dumped:
+            # Dump the preamble for the next builds
+            self._steps = [self.preamble.format_step()]
+            self._dumped = True
+        if not self._steps:
+            if self.preamble:
+                self.preamble.save()
+            return None
+        step = self._steps.pop(0)
+        self._started = (step['name'], time.time())
+        return step
+
+    def step_done(self, step, returncode, output):
+        """Records the result of `step'. `output' is the standard output
+        of the step as a string."""
+        name, started = self._started
+        self.timings.append((name, time.time() - started))
+        logging.debug("TeX-9: Step `{0}' finished with status {1} in {2:.2f} s".format(
+            name, returncode, self.timings[-1][1]))
+        if step['parse']:
+            self.returncode = returncode
+            self.output = output
+        if name in self._pending:
+            inputs = self._pending.pop(name)
+            self._ran[name] = inputs
+            if returncode <= TOOL_WARNINGS.get(name, 0):
+                _tool_inputs[(self.master, self.outdir, name)] = inputs
+        if name == 'bibtex':
+            self.errors += [e for e in bibtex_errors(output) if e not in self.errors]
+        elif name == 'format':
+            self.preamble.format_done(returncode)
+        elif name == 'latex':
+            if returncode != 0 and self.fmt and FORMAT_ERROR_PAT.search(output):
+                # Run the pass again without the format, which is dumped
+                # again at the end
+                logging.debug("TeX-9: Cannot load the format, running the pass without it")
+                self.fmt = None
+                self._steps = [self.latex_step(step['draft'])]
+                return
+            self.passes += 1
+            self.pass_times.append((self.timings[-1][1], step['draft']))
+            if self.fmt:
+                self.fmt_passes += 1
+            if self.preamble and not step['draft']:
+                self.preamble.record_pass(self.fmt, self.timings[-1][1])
+            self.schedule(step['draft'])
+
+    def saved_time(self):
+        """Returns the estimated time the precompiled preamble saved in
+        this build or None."""
+        if self.fmt_passes:
+            return self.preamble.saved(self.fmt_passes)
+        return None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def inputs(self):
+        """Returns the files that the last LaTeX pass read and the
+        bibliographies BibTeX read. Requires `recorder'."""
+        files = recorder_inputs(self._path('.fls'))
+        bibs = []
+        for aux in aux_files(self.outdir, self.jobname):
+            try:
+                with open(aux) as f:
+                    found = re.findall(r'^\\bibdata{([^}]+)}', f.read(), re.M)
+            except IOError:
+                continue
+            bibs += ",".join(found).split(',')
+        try:
+            with open(self._path('.bcf')) as f:
+                bibs += re.findall(r'<bcf:datasource[^>]*>([^<]+)</bcf:datasource>',
+                                   f.read())
+        except IOError:
+            pass
+        return files + find_bibfiles(self.cwd, bibs)
+
+    def make_outdir(self, files):
+        """Creates the output directory. LaTeX also needs the
+        subdirectories where the .aux files of the \include'd `files'
+        go."""
+        for fname in files:
+            reldir = path.relpath(path.dirname(fname), self.cwd)
+            if reldir.startswith(os.pardir):
+                continue
+            dirname = path.normpath(path.join(self.outdir, reldir))
+            if not path.isdir(dirname):
+                os.makedirs(dirname)
+
+    def publish(self, extensions=('.pdf', '.dvi', '.synctex.gz')):
+        """Copies the output files from the output directory next to the
+        master file."""
+        if self.outdir == self.cwd:
+            return
+        for ext in extensions:
+            if path.exists(self._path(ext)):
+                shutil.copy2(self._path(ext),
+                             path.join(self.cwd, self.jobname+ext))
+
+    def succeeded(self):
+        """Returns True if the build ran to the end and the last LaTeX
+        pass did not fail."""
+        return not self.cancelled and not self._steps and self.returncode == 0
+
+    def run(self):
+        """Runs the steps in this process.
+
+        Returns the output of the last step that contains LaTeX errors.
+        """
+        while True:
+            step = self.next_step()
+            if step is None:
+                return self.output
+            proc = subprocess.Popen(step['args'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    cwd=step['cwd'])
+            stdout = proc.communicate()[0]
+            self.step_done(step, proc.returncode, stdout)
+
+def run_builds(builds, jobs):
+    """Runs `builds' in this process, at most `jobs' at the same time.
+
+    Every build runs in its own thread; the threads spend their time
+    waiting for the LaTeX processes. Returns when all builds are done.
+    """
+
+    queue = Queue.Queue()
+    for build in builds:
+        queue.put(build)
+
+    def work():
+        while True:
+            try:
+                build = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                build.run()
+            except OSError, e:
+                logging.debug("TeX-9: Cannot build `{0}': {1}".format(build.master, e))
+                build.cancel()
+
+    threads = [threading.Thread(target=work, name='tex_nine_build')
+               for i in range(max(1, min(jobs, len(builds))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+class TeXNineBuildQueue(object):
+    """Runs several builds, at most `jobs' at the same time, for a
+    caller that runs the steps itself, e.g. with Vim's job control.
+
+    next_steps() returns the steps that can start now as 2-tuples
+    (build number, step) and step_done() records the result of a step.
+    The queue is done when next_steps() returns nothing and no step is
+    running.
+
+    """
+
+    def __init__(self, builds, jobs):
+        self.builds = builds
+        self.jobs = max(1, jobs)
+        self._waiting = range(len(builds))
+        self._active = []
+        self._running = {}
+
+    def next_steps(self):
+        steps = []
+        while True:
+            while self._waiting and len(self._active) < self.jobs:
+                self._active.append(self._waiting.pop(0))
+            idle = [i for i in self._active if i not in self._running]
+            if not idle:
+                return steps
+            for i in idle:
+                step = self.builds[i].next_step()
+                if step is None:
+                    self._active.remove(i)
+                else:
+                    self._running[i] = step
+                    steps.append((i, step))
+
+    def step_done(self, i, returncode, output):
+        """Records the result of the running step of the build `i'.
+        `output' is the standard output of the step as a string."""
+        step = self._running.pop(i, None)
+        if step is not None:
+            self.builds[i].step_done(step, returncode, output)
+
+    def done(self):
+        return not self._waiting and not self._active
+
+class TeXNineManifest(object):
+    """The inputs of the last successful build of a master file.
+
+    The manifest is kept in the user cache directory under the digest of
+    the path of the master file: a pickle in the project could be planted
+    by anyone who can write there. It maps every input to its stamp
+    (mtime, size) and the MD5 digest of its content; a file is hashed
+    again only when its stamp changes, and touching a file without
+    changing it does not count as a change. The options of the build (the
+    compiler and 'makeprg'), whether it was a deep build, and its output
+    and BibTeX errors are stored as well so that the results can be
+    reused.
+
+    """
+
+    def __init__(self, master, inputs, options):
+        self.cache = TeXNineCache('manifest-'+hashlib.md5(master).hexdigest())
+        self.files = inputs
+        self.options = options
+        self.data = self.cache.load() or {}
+        self.inputs = self.hashes()
+
+    def hashes(self):
+        """Returns a dictionary that maps the input files to 2-tuples
+        (stamp, digest)."""
+        known = self.data.get('inputs', {})
+        hashes = {}
+        for fname in self.files:
+            try:
+                st = os.stat(fname)
+                stamp = (st.st_mtime, st.st_size)
+            except OSError:
+                stamp = None
+            record = known.get(fname)
+            if record is None or record[0] != stamp:
+                record = (stamp, file_hash(fname) if stamp else None)
+            hashes[fname] = record
+        return hashes
+
+    def up_to_date(self, deep, output):
+        """Returns True if `output' exists and was built with the same
+        options from the same inputs. A deep build is as good as a small
+        one but not vice versa."""
+
+        if (not self.data or self.data['options'] != self.options
+            or self.data['deep'] < deep or not path.exists(output)):
+            return False
+        digests = lambda inputs: dict((f, r[1]) for f, r in inputs.items())
+        return digests(self.data['inputs']) == digests(self.inputs)
+
+    def record(self, deep, output, errors):
+        """Stores the inputs, the options and the results of a
+        successful build."""
+        self.data = dict(options=self.options, deep=deep, inputs=self.inputs,
+                         output=output, errors=errors)
+        self.cache.save(self.data)
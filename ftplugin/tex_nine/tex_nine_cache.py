@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Persistent caches that survive Vim restarts. Each cache is a pickled
+# file in the user cache directory ($XDG_CACHE_HOME/tex_nine or
+# ~/.cache/tex_nine). Does not depend on Vim.
+
+import os
+import os.path as path
+import logging
+import cPickle as pickle
+
+def cache_dir():
+    """Returns the directory where TeX-9 keeps its caches."""
+    base = os.environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache')
+    return path.join(base, 'tex_nine')
+
+class TeXNineCache(object):
+    """A versioned on-disk cache.
+
+    The cached data is discarded when the version stored in the file
+    differs from `version', so bump the version whenever the layout of
+    the data changes. Errors are logged and never raised: a broken cache
+    is just an empty cache.
+
+    """
+
+    def __init__(self, name, version=1, directory=None):
+        self.name = name
+        self.version = version
+        self.directory = directory or cache_dir()
+
+    @property
+    def filename(self):
+        return path.join(self.directory, self.name+'.pickle')
+
+    def load(self):
+        """Returns the cached data or None."""
+        try:
+            with open(self.filename, 'rb') as f:
+                cached = pickle.load(f)
+        except IOError:
+            return None
+        except Exception, e:
+            logging.debug("TeX-9: Discarding broken cache `{0}': {1}".format(self.name, e))
+            return None
+
+        if not isinstance(cached, dict) or cached.get('version') != self.version:
+            logging.debug("TeX-9: Discarding outdated cache `{0}'".format(self.name))
+            return None
+
+        logging.debug("TeX-9: Loaded cache `{0}'".format(self.name))
+        return cached['data']
+
+    def save(self, data):
+        """Writes `data' to disk atomically."""
+        tmp = self.filename+'.{0}.tmp'.format(os.getpid())
+        try:
+            if not path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmp, 'wb') as f:
+                pickle.dump({'version': self.version, 'data': data}, f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.filename)
+            logging.debug("TeX-9: Saved cache `{0}'".format(self.name))
+        except (IOError, OSError, pickle.PicklingError), e:
+            logging.debug("TeX-9: Cannot save cache `{0}': {1}".format(self.name, e))
+            if path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self):
+        if path.exists(self.filename):
+            os.remove(self.filename)
+
+def cache_info(directory=None):
+    """Returns a list of 2-tuples (cache name, size in bytes)."""
+    directory = directory or cache_dir()
+    if not path.isdir(directory):
+        return []
+    info = []
+    for fname in sorted(os.listdir(directory)):
+        if fname.endswith('.pickle'):
+            size = path.getsize(path.join(directory, fname))
+            info.append((fname[:-len('.pickle')], size))
+    return info
+
+def clear_caches(directory=None):
+    """Removes all caches. Returns the names of the removed caches."""
+    directory = directory or cache_dir()
+    names = [name for name, size in cache_info(directory)]
+    for name in names:
+        TeXNineCache(name, directory=directory).clear()
+    return names
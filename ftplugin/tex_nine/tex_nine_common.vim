@@ -39,7 +39,28 @@ let b:tex_nine_config = {
             \    'debug': 0,
             \    'synctex' : 0,
             \    'extra_args' : '',
-            \    'shell_escape' : 0
+            \    'shell_escape' : 0,
+            \    'cache' : 1,
+            \    'worker' : 1,
+            \    'worker_budget' : 100,
+            \    'pics_depth' : 2,
+            \    'symbols' : [],
+            \    'fuzzy' : 0,
+            \    'async' : 0,
+            \    'compile_callback' : '',
+            \    'max_passes' : 5,
+            \    'manifest' : 1,
+            \    'jobs' : 0,
+            \    'master_levels' : 4,
+            \    'compile_on_save' : 0,
+            \    'debounce' : 500,
+            \    'server' : 0,
+            \    'server_python' : 'python2',
+            \    'server_interval' : 300,
+            \    'preamble' : 0,
+            \    'draft' : 0,
+            \    'snippet_dirs' : [],
+            \    'sync_viewer' : ''
             \}
 
 " Override values with user preferences
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNinePictures, an index of the pictures in a set of
+# directories. A directory is listed again only when its mtime changes.
+# Does not depend on Vim.
+
+import os
+import os.path as path
+import logging
+from bisect import bisect_left
+
+PICTURE_EXTENSIONS = frozenset(['.pdf', '.png', '.jpg', '.jpeg', '.eps'])
+
+class TeXNinePictures(object):
+    """Index of picture files.
+
+    Every directory seen is stored as a 3-tuple (mtime, pictures,
+    subdirectories). pictures() returns the pictures under a list of
+    root directories, descending at most `depth' levels. Use prefixed()
+    to pick the ones that start with a given prefix.
+
+    """
+
+    def __init__(self, extensions=PICTURE_EXTENSIONS, depth=2):
+        self.extensions = extensions
+        self.depth = depth
+        self._dirs = {}
+        self._pictures = (None, [])
+
+    def _scan(self, dirname):
+        """Returns the record of `dirname', listing it if needed."""
+        try:
+            mtime = os.stat(dirname).st_mtime
+        except OSError:
+            self._dirs.pop(dirname, None)
+            return None
+
+        record = self._dirs.get(dirname)
+        if record is None or record[0] != mtime:
+            logging.debug("TeX-9: Listing pictures in `{0}'".format(dirname))
+            pictures = []
+            subdirs = []
+            for f in os.listdir(dirname):
+                if f.startswith('.'):
+                    continue
+                if path.splitext(f)[1].lower() in self.extensions:
+                    pictures.append(f)
+                elif path.isdir(path.join(dirname, f)):
+                    subdirs.append(f)
+            record = (mtime, pictures, subdirs)
+            self._dirs[dirname] = record
+        return record
+
+    def pictures(self, roots):
+        """Returns a sorted list of the pictures under `roots'.
+
+        The names are relative to the root they were found in. The list
+        is reused as long as none of the directories changes.
+        """
+
+        visited = []
+        for root in roots:
+            stack = [('', 0)]
+            while stack:
+                reldir, level = stack.pop()
+                record = self._scan(path.normpath(path.join(root, reldir)))
+                if record is None:
+                    continue
+                visited.append((root, reldir, record))
+                if level < self.depth:
+                    stack.extend((path.join(reldir, d), level + 1)
+                                 for d in record[2])
+
+        stamp = [(root, reldir, record[0]) for root, reldir, record in visited]
+        if self._pictures[0] != stamp:
+            found = set([])
+            for root, reldir, record in visited:
+                found.update(path.join(reldir, p) for p in record[1])
+            self._pictures = (stamp, sorted(found))
+        return self._pictures[1]
+
+def prefixed(items, base):
+    """Returns the items of the sorted list `items' that start with
+    `base'."""
+    i = bisect_left(items, base)
+    j = i
+    while j < len(items) and items[j].startswith(base):
+        j += 1
+    return items[i:j]
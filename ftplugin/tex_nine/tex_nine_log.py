@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNineLogParser that turns the output of LaTeX into quickfix
+# entries. The output is fed in chunks as it arrives; the parser keeps
+# track of the file being read from the parentheses that TeX writes
+# when it opens and closes files. Does not depend on Vim.
+
+import re
+import os.path as path
+
+FILE_LINE_ERROR = re.compile(r'^(\S[^:]*):(\d+): (.*)$')
+ERROR = re.compile(r'^! (.*)$')
+WARNING = re.compile(r'^(?:(?:LaTeX|Package|Class)\b.*?|pdfTeX) [Ww]arning(?: \([^)]*\))?: (.*)$')
+BOX = re.compile(r'^(?:Over|Under)full \\[hv]box .*$')
+ERROR_LINE = re.compile(r'^l\.(\d+)')
+INPUT_LINE = re.compile(r'(?:on input line|at lines?) (\d+)')
+CONTINUATION = re.compile(r'^\([^)]*\)\s*')
+PARENTHESIS = re.compile(r'\(([^\s()]*)|\)')
+FILENAME = re.compile(r'\.{0,2}/|[\w-]+\.\w{1,4}$')
+
+class TeXNineLogParser(object):
+    """Incremental parser of LaTeX's output.
+
+    Feed the lines with feed() and call close() when the output ends.
+    Both return the quickfix entries completed by the new lines as
+    dictionaries with the keys 'filename', 'lnum', 'text' and 'type'
+    ('E' or 'W'). Relative filenames are resolved against `basedir', the
+    directory where LaTeX runs.
+
+    Overfull and underfull boxes are dropped unless `verbose' is set.
+    TeX wraps its output at `max_print_line' characters; wrapped lines
+    are joined before parsing.
+
+    """
+
+    def __init__(self, basedir, verbose=False, max_print_line=79):
+        self.basedir = basedir
+        self.verbose = verbose
+        self.max_print_line = max_print_line
+        self.errors = 0
+        self.warnings = 0
+        self._files = []
+        self._wrapped = ""
+        self._message = None
+
+    def current_file(self):
+        for fname in reversed(self._files):
+            if fname is not None:
+                return fname
+        return None
+
+    def _filename(self, fname):
+        return path.normpath(path.join(self.basedir, fname))
+
+    def _track_files(self, line):
+        """Updates the stack of open files."""
+        for m in PARENTHESIS.finditer(line):
+            if m.group(0) == ')':
+                if self._files:
+                    self._files.pop()
+            elif FILENAME.match(m.group(1)):
+                self._files.append(self._filename(m.group(1)))
+            else:
+                # Other parentheses are pushed too so that they are
+                # balanced when closed
+                self._files.append(None)
+
+    def _start(self, line):
+        """Returns a new message if `line' starts one."""
+
+        m = FILE_LINE_ERROR.match(line)
+        if m and not line.startswith('!'):
+            return dict(filename=self._filename(m.group(1)),
+                        lnum=int(m.group(2)), text=m.group(3), type='E',
+                        lines=[])
+        m = ERROR.match(line)
+        if m:
+            return dict(filename=self.current_file(), lnum=0,
+                        text=m.group(1), type='E', lines=[])
+        m = WARNING.match(line)
+        if m:
+            return dict(filename=self.current_file(), lnum=0,
+                        text=m.group(1), type='W', lines=[])
+        if BOX.match(line):
+            return dict(filename=self.current_file(), lnum=0, text=line,
+                        type='W', box=1, lines=[])
+        return None
+
+    def _finish(self):
+        """Returns the message being read as a quickfix entry or None."""
+
+        message, self._message = self._message, None
+        if message is None:
+            return None
+        if message.get('box') and not self.verbose:
+            return None
+
+        for line in [message['text']] + message['lines']:
+            m = ERROR_LINE.match(line) or INPUT_LINE.search(line)
+            if m and not message['lnum']:
+                message['lnum'] = int(m.group(1))
+        if message['type'] == 'W' and not message.get('box'):
+            # Continuation lines of package warnings start with
+            # `(package)'
+            text = [message['text']] + [CONTINUATION.sub('', l)
+                                        for l in message['lines']]
+            message['text'] = " ".join(l.strip() for l in text)
+
+        if message['type'] == 'E':
+            self.errors += 1
+        else:
+            self.warnings += 1
+        return dict(filename=message['filename'] or '', lnum=message['lnum'],
+                    text=message['text'], type=message['type'])
+
+    def _parse(self, line):
+        entries = []
+        message = self._message
+        if message is not None and len(message['lines']) < 20:
+            if message['type'] == 'E' and not message['lnum']:
+                # TeX shows the help text and the line of the error
+                # (`l.42 ...') after the message
+                message['lines'].append(line)
+                if ERROR_LINE.match(line):
+                    entries.append(self._finish())
+                return entries
+            if line.strip():
+                message['lines'].append(line)
+                return entries
+        if message is not None:
+            entries.append(self._finish())
+
+        # Messages quote the source, so their parentheses do not count
+        self._message = self._start(line)
+        if self._message is None:
+            self._track_files(line)
+        return [e for e in entries if e is not None]
+
+    def feed(self, lines):
+        """Parses `lines' and returns the entries they complete."""
+        entries = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if len(line) == self.max_print_line:
+                self._wrapped += line
+                continue
+            line, self._wrapped = self._wrapped+line, ""
+            entries += self._parse(line)
+        return entries
+
+    def close(self):
+        """Returns the entries that are still pending."""
+        entries = []
+        if self._wrapped:
+            entries += self._parse(self._wrapped)
+            self._wrapped = ""
+        entry = self._finish()
+        if entry is not None:
+            entries.append(entry)
+        return entries
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNineProject that follows \input, \include, \subfile and
+# \import statements recursively starting from a master file. Every
+# file is scanned once and scanned again only when its stamp changes.
+# The stamp and the content of a file are provided by a reader object
+# so that the module does not depend on Vim. TeXNineMasterIndex maps
+# files back to the master files that include them.
+
+import re
+import os
+import os.path as path
+import logging
+
+INCLUDE_PAT = re.compile(r'\\(input|include|subfile|subfileinclude)\s*{([^}]+)}'
+                         r'|\\(import|subimport|inputfrom|subinputfrom|includefrom|subincludefrom)\*?\s*{([^}]*)}\s*{([^}]+)}')
+LABEL_PAT = re.compile(r'\\label{([^,}]+)}')
+GRAPHICSPATH_PAT = re.compile(r'\\graphicspath\s*{((?:\s*{[^}]*})*)\s*}')
+COMMENT_PAT = re.compile(r'(?<!\\)%.*')
+DOCUMENTCLASS_PAT = re.compile(r'^[^%]*\\documentclass')
+ENVIRONMENT_PAT = re.compile(r'\\(?:(?:re)?newenvironment|(?:New|Renew|Provide|Declare)DocumentEnvironment|newtheorem)\*?\s*{([^}]+)}')
+RESOURCE_PAT = re.compile(r'\\(bibliography|addbibresource|includegraphics|usepackage|RequirePackage|documentclass)\*?\s*(?:\[[^]]*\]\s*)*{([^}]+)}')
+
+# Files and directories that mark the top of a project
+PROJECT_MARKERS = ('.git', '.hg', '.svn', '.latexmkrc', 'latexmkrc')
+
+# Extensions tried for the arguments of the commands in RESOURCE_PAT
+RESOURCE_EXTENSIONS = {
+    'bibliography': ['.bib'],
+    'addbibresource': [''],
+    'includegraphics': ['', '.pdf', '.png', '.jpg', '.jpeg', '.eps'],
+    'usepackage': ['.sty'],
+    'RequirePackage': ['.sty'],
+    'documentclass': ['.cls'],
+}
+
+class TeXNineFileReader(object):
+    """Reads files from disk.
+
+    The stamp of a file is the 2-tuple (mtime, size).
+    """
+
+    def stamp(self, fname):
+        """Returns the stamp of `fname' or None if it does not exist."""
+        try:
+            st = os.stat(fname)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def read(self, fname):
+        """Returns the lines of `fname'. Raises IOError."""
+        with open(fname) as f:
+            return f.read().splitlines()
+
+def parse_tex(lines):
+    """Finds labels and included files in a list of lines.
+
+    Returns a 5-tuple (labels, includes, graphicspath, resources,
+    environments) where includes is a list of 3-tuples (command,
+    directory, filename) in the order of appearance, graphicspath lists
+    the directories given in \graphicspath statements, resources is a
+    list of 2-tuples (command, name) for the bibliographies, pictures,
+    packages and classes the file uses and environments lists the
+    environments the file defines.
+
+    """
+
+    labels = []
+    includes = []
+    graphicspath = []
+    resources = []
+    environments = []
+    for line in lines:
+        if '\\' not in line:
+            continue
+        if '%' in line:
+            line = COMMENT_PAT.sub('', line)
+        labels += LABEL_PAT.findall(line)
+        for m in INCLUDE_PAT.finditer(line):
+            if m.group(1):
+                includes.append((m.group(1), '', m.group(2).strip()))
+            else:
+                includes.append((m.group(3), m.group(4).strip(),
+                                 m.group(5).strip()))
+        for m in GRAPHICSPATH_PAT.finditer(line):
+            graphicspath += re.findall(r'{([^}]*)}', m.group(1))
+        for m in RESOURCE_PAT.finditer(line):
+            names = [m.group(2)]
+            if m.group(1) != 'includegraphics':
+                names = m.group(2).split(',')
+            resources += [(m.group(1), n.strip()) for n in names if n.strip()]
+        environments += [e.strip() for e in ENVIRONMENT_PAT.findall(line)]
+    return (labels, includes, graphicspath, resources, environments)
+
+def resolve_include(command, directory, fname, basedir, filedir):
+    """Returns the absolute filename of an included file and the base
+    directory for the files it includes in turn.
+
+    Following the `import' package, \\import'ed files take their path
+    relative to `basedir' (or an absolute path) and \\subimport'ed files
+    take it relative to `filedir', the directory of the including file.
+    Other commands resolve relative to `basedir'.
+
+    """
+
+    if command.startswith('sub') and command not in ('subfile', 'subfileinclude'):
+        basedir = path.join(filedir, directory)
+    elif directory:
+        basedir = path.join(basedir, directory)
+
+    fname = path.join(basedir, fname)
+    if not path.splitext(fname)[1]:
+        fname += '.tex'
+    return (path.normpath(fname), path.normpath(basedir))
+
+def find_masters(root, depth=2, nlines=50):
+    """Returns the master files under `root'.
+
+    A master file is a .tex file with a \documentclass statement in its
+    first `nlines' lines. Descends at most `depth' levels and skips
+    hidden directories.
+
+    """
+
+    masters = []
+    stack = [(root, 0)]
+    while stack:
+        dirname, level = stack.pop()
+        try:
+            names = sorted(os.listdir(dirname))
+        except OSError:
+            continue
+        for name in names:
+            fname = path.join(dirname, name)
+            if name.startswith('.'):
+                continue
+            elif name.endswith('.tex'):
+                try:
+                    with open(fname) as f:
+                        for i, line in enumerate(f):
+                            if i >= nlines:
+                                break
+                            if DOCUMENTCLASS_PAT.match(line):
+                                masters.append(fname)
+                                break
+                except IOError:
+                    pass
+            elif level < depth and path.isdir(fname):
+                stack.append((fname, level + 1))
+    return sorted(masters)
+
+class TeXNineProject(object):
+    """The include graph of a LaTeX project.
+
+    Keeps a record (stamp, labels, includes, graphicspath, resources,
+    environments) for every file it has seen. Use walk() to get the files
+    of a project, labels() to get the labels in it, graphicspath() to get
+    the directories where pictures are looked up, inputs() to get every
+    file a build of the project reads and environments() to get the
+    environments it defines.
+
+    """
+
+    def __init__(self, reader=None):
+        self.reader = reader or TeXNineFileReader()
+        self._files = {}
+        self._labels = (None, None, [])
+
+    def scan(self, fname):
+        """Returns the record of `fname', scanning it if needed.
+
+        Returns None if the file cannot be read.
+        """
+
+        stamp = self.reader.stamp(fname)
+        if stamp is None:
+            self._files.pop(fname, None)
+            return None
+
+        record = self._files.get(fname)
+        if record is None or record[0] != stamp:
+            try:
+                lines = self.reader.read(fname)
+            except IOError, e:
+                # Do not raise an error because the \include statement
+                # might be commented
+                logging.debug("TeX-9: Cannot read `{0}': {1}".format(fname, e))
+                return None
+            logging.debug("TeX-9: Scanning `{0}'".format(path.basename(fname)))
+            record = (stamp,) + parse_tex(lines)
+            self._files[fname] = record
+
+        return record
+
+    def walk(self, master):
+        """Returns the files of the project in document order.
+
+        The master file comes first. Every file appears only once even
+        if it is included several times.
+
+        """
+
+        return [fname for fname, basedir in self._walk(master)]
+
+    def _walk(self, master):
+        """Returns the files of the project as 2-tuples (filename,
+        base directory) where the base directory is the one the file
+        resolves its own includes against, see resolve_include()."""
+
+        seen = set([])
+        files = []
+        stack = [(master, path.dirname(master))]
+        while stack:
+            fname, basedir = stack.pop()
+            if fname in seen:
+                continue
+            seen.add(fname)
+            record = self.scan(fname)
+            if record is None:
+                continue
+            files.append((fname, basedir))
+            children = [resolve_include(c, d, f, basedir, path.dirname(fname))
+                        for c, d, f in record[2]]
+            stack.extend(reversed(children))
+        return files
+
+    def labels(self, master):
+        """Returns a list of 2-tuples (label, filename).
+
+        The list is reused as long as no file in the project changes.
+        """
+
+        files = self.walk(master)
+        stamps = [(f, self._files[f][0]) for f in files]
+        if self._labels[:2] == (master, stamps):
+            return self._labels[2]
+
+        labels = []
+        for fname in files:
+            labels += [(l, fname) for l in self._files[fname][1]]
+        self._labels = (master, stamps, labels)
+        return labels
+
+    def graphicspath(self, master):
+        """Returns the absolute directories in \graphicspath statements."""
+        dirs = []
+        master_folder = path.dirname(master)
+        for fname in self.walk(master):
+            for d in self._files[fname][3]:
+                d = path.normpath(path.join(master_folder, d))
+                if d not in dirs:
+                    dirs.append(d)
+        return dirs
+
+    def inputs(self, master, resolve=None):
+        """Returns a sorted list of the files that LaTeX and BibTeX read
+        when the project is built.
+
+        Besides the files of the project the list contains the included
+        files that do not exist (yet), the bibliographies, the pictures
+        and the packages and classes found in the project directories.
+        Files that TeX finds in its own trees are left out, except for
+        the bibliographies that `resolve' finds: it is called with the
+        master folder and the names of the .bib files missing from it and
+        returns a dictionary that maps the names to absolute paths.
+
+        """
+
+        files = self._walk(master)
+        master_folder = path.dirname(master)
+        picture_dirs = [master_folder] + self.graphicspath(master)
+        inputs = set(fname for fname, basedir in files)
+        missing = []
+        for fname, basedir in files:
+            record = self._files[fname]
+            # Missing files matter as they might appear later
+            inputs.update(resolve_include(c, d, f, basedir, path.dirname(fname))[0]
+                          for c, d, f in record[2])
+            for command, name in record[4]:
+                dirs = picture_dirs if command == 'includegraphics' else [master_folder]
+                for ext in RESOURCE_EXTENSIONS[command]:
+                    candidates = [path.normpath(path.join(d, name+ext)) for d in dirs]
+                    found = [c for c in candidates if path.isfile(c)]
+                    if found:
+                        inputs.add(found[0])
+                        break
+                else:
+                    if command in ('bibliography', 'addbibresource'):
+                        missing.append(name+RESOURCE_EXTENSIONS[command][0])
+        if missing and resolve is not None:
+            inputs.update(p for p in resolve(master_folder, missing).values() if p)
+        return sorted(inputs)
+
+    def environments(self, master):
+        """Returns the names of the environments defined in the project
+        and in the packages and classes next to the master file."""
+        files = self.walk(master)
+        master_folder = path.dirname(master)
+        # Only the packages and classes matter here: do not look for the
+        # other resources
+        packages = []
+        for fname in files:
+            for command, name in self._files[fname][4]:
+                if command in ('usepackage', 'RequirePackage', 'documentclass'):
+                    ext = RESOURCE_EXTENSIONS[command][0]
+                    packages.append(path.join(master_folder, name+ext))
+        names = set([])
+        for fname in files + packages:
+            record = self.scan(fname)
+            if record is not None:
+                names.update(record[5])
+        return sorted(names)
+
+    def stamps(self):
+        """Returns a dictionary that maps filenames to their stamps."""
+        return dict((f, r[0]) for f, r in self._files.items())
+
+    def discard(self, fname):
+        self._files.pop(fname, None)
+
+class TeXNineMasterIndex(object):
+    """Reverse include index: maps files to the master files whose
+    projects contain them.
+
+    The master files are found with find_masters() in the directories
+    above a file, at most `levels' of them and not above a directory that
+    holds one of PROJECT_MARKERS; a directory is scanned again only when
+    its mtime changes. The include graph of a master file is walked the first time
+    a file next to it is looked up and again after invalidate() was
+    called with one of its files, e.g. when the master file was written
+    with a new \include. `generation' is incremented every time the
+    answer of masters() may have changed.
+
+    """
+
+    def __init__(self, project=None, depth=1, levels=4):
+        self.project = project or TeXNineProject()
+        self.depth = depth
+        self.levels = levels
+        self.generation = 0
+        self._roots = {}
+        self._graphs = {}
+
+    def add_root(self, root):
+        """Looks for master files under `root' if needed."""
+        try:
+            mtime = os.stat(root).st_mtime
+        except OSError:
+            self._roots.pop(root, None)
+            return
+        record = self._roots.get(root)
+        if record is None or record[0] != mtime:
+            logging.debug("TeX-9: Looking for master files in `{0}'".format(root))
+            found = find_masters(root, self.depth)
+            if record is not None and record[1] != found:
+                self.generation += 1
+            self._roots[root] = (mtime, found)
+
+    def _walk(self, master):
+        """Records the files of the project of `master' and the files
+        that would change it."""
+        files = self.project.walk(master)
+        # Included files that do not exist yet are watched too
+        watched = set(self.project.inputs(master))
+        self._graphs[master] = (set(files), watched)
+        logging.debug("TeX-9: Indexed {0} file(s) of `{1}'".format(
+            len(files), path.basename(master)))
+
+    def invalidate(self, fname):
+        """Forgets the include graphs that contain or watch `fname' so
+        that they are walked again on the next lookup."""
+        stale = [m for m, (files, watched) in self._graphs.items()
+                 if fname == m or fname in files or fname in watched]
+        for master in stale:
+            del self._graphs[master]
+        if stale:
+            self.generation += 1
+
+    def is_master(self, fname):
+        """Returns True if `fname' is a master file. Does not walk any
+        include graph."""
+        dirname = path.dirname(fname)
+        self.add_root(dirname)
+        return fname in self._roots.get(dirname, (None, []))[1]
+
+    def ancestors(self, fname):
+        """Returns the directory of `fname' and the directories above
+        it up to the top of the project."""
+        dirs = []
+        dirname = path.dirname(fname)
+        while len(dirs) <= self.levels and dirname not in dirs:
+            dirs.append(dirname)
+            if any(path.exists(path.join(dirname, m)) for m in PROJECT_MARKERS):
+                break
+            dirname = path.dirname(dirname)
+        return dirs
+
+    def masters(self, fname, roots=(), nearest=False):
+        """Returns the master files whose projects contain `fname'.
+
+        Looks for master files in the directories returned by
+        ancestors(), nearest first, and in `roots'. Only the include
+        graphs of these master files are walked, if they have not been
+        walked yet, and a master counts only if its graph contains
+        `fname'. If `nearest' is set, the search stops at the first
+        directory that has master files containing `fname'.
+        """
+
+        masters = []
+        for root in self.ancestors(fname) + list(roots):
+            self.add_root(root)
+            for master in self._roots.get(root, (None, []))[1]:
+                if master not in self._graphs:
+                    self._walk(master)
+                if fname in self._graphs[master][0] and master not in masters:
+                    masters.append(master)
+            if masters and nearest:
+                break
+        return sorted(masters)
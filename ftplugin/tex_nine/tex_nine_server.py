@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# A build server for one master file, run as a separate process:
+#
+#   python tex_nine_server.py MASTER COMPILER MAKEPRG DEEP INTERVAL VERBOSE
+#
+# The server builds the master file with LaTeX's -recorder option and
+# learns from the .fls file which files the build read. It polls only
+# those files every INTERVAL milliseconds and builds again when one of
+# them changes. Commands arrive on the standard input and results are
+# written to the standard output, one JSON object per line:
+#
+#   {"cmd": "build"}   Build now; "deep": 0 or 1 overrides DEEP
+#   {"cmd": "stop"}    Exit; so does the end of the standard input
+#
+#   {"event": "build", "master": ..., "entries": [...], "errors": N,
+#    "bibtex": [...], "seconds": S, "inputs": N}
+#
+# where the entries are quickfix entries and "bibtex" lists the BibTeX
+# errors as (message key, argument) pairs. Does not depend on Vim.
+
+import sys
+import os
+import select
+import json
+import time
+import logging
+
+from tex_nine_build import TeXNineBuild
+from tex_nine_log import TeXNineLogParser
+
+class TeXNineServer(object):
+    """Builds a master file whenever one of its inputs changes."""
+
+    def __init__(self, master, compiler, makeprg, deep, verbose=False):
+        self.master = master
+        self.compiler = compiler
+        self.makeprg = makeprg
+        self.deep = deep
+        self.verbose = verbose
+        self._stamps = {}
+
+    def stamps(self, files):
+        stamps = {}
+        for fname in files:
+            try:
+                st = os.stat(fname)
+                stamps[fname] = (st.st_mtime, st.st_size)
+            except OSError:
+                stamps[fname] = None
+        return stamps
+
+    def changed(self):
+        """Returns True if an input of the last build changed."""
+        return self.stamps(self._stamps.keys()) != self._stamps
+
+    def build(self, deep=None):
+        """Builds the master file and returns the result as a
+        dictionary. `deep' overrides the mode the server was started
+        with."""
+
+        start = time.time()
+        build = TeXNineBuild(self.master, self.compiler,
+                             self.deep if deep is None else deep,
+                             self.makeprg, recorder=True)
+        output = build.run()
+        inputs = build.inputs() or [self.master]
+        products = set(os.path.normpath(f) for f in build.products)
+        self._stamps = self.stamps(inputs)
+        for fname, stamp in self._stamps.items():
+            if stamp and stamp[0] >= start and fname not in products:
+                # Changed during the build: build again
+                self._stamps[fname] = None
+
+        log = TeXNineLogParser(build.cwd, self.verbose)
+        entries = log.feed(output.splitlines()) + log.close()
+        return dict(event='build', master=self.master, entries=entries,
+                    errors=log.errors, bibtex=build.errors,
+                    seconds=round(time.time() - start, 3), inputs=len(inputs))
+
+def send(message):
+    sys.stdout.write(json.dumps(message)+"\n")
+    sys.stdout.flush()
+
+def main(argv):
+    master, compiler, makeprg, deep, interval, verbose = argv[1:7]
+    server = TeXNineServer(master, compiler, makeprg, int(deep), int(verbose))
+    interval = int(interval)/1000.0
+    send(server.build())
+
+    # Read the standard input unbuffered: select() does not know about
+    # the lines that file objects keep in their buffers
+    fd = sys.stdin.fileno()
+    pending = ""
+    while True:
+        ready = select.select([fd], [], [], interval)[0]
+        if ready:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            lines = (pending + data).split("\n")
+            pending = lines.pop()
+            builds = []
+            for line in lines:
+                try:
+                    command = json.loads(line)
+                except ValueError:
+                    logging.debug("TeX-9: Invalid command `{0}'".format(line.strip()))
+                    continue
+                if command.get('cmd') == 'stop':
+                    return
+                elif command.get('cmd') == 'build':
+                    builds.append(command.get('deep'))
+            if builds:
+                # Commands that queued up during a build need one build,
+                # a deep one if any of them asked for it
+                modes = [d for d in builds if d is not None]
+                send(server.build(max(modes) if modes else None))
+        elif server.changed():
+            send(server.build())
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Compiles snippet files whose syntax resembles that of snipMate into
+# tables that map keywords to snippets. TeXNineSnippetStore keeps the
+# table of every filetype in memory and in an on-disk cache; a table is
+# compiled again only when one of its files changes. Does not depend on
+# Vim.
+
+import os
+import os.path as path
+import re
+import logging
+
+SNIPPET_PAT = re.compile(r'^snippet\s+(\S+)')
+
+def parse_snippets(lines):
+    """Returns a dictionary that maps keywords to snippets.
+
+    A snippet starts with a line `snippet keyword' and its body is made
+    of the indented lines that follow it. The leading whitespace of
+    every line is removed, since Vim indents the inserted lines itself,
+    as are trailing empty lines. Lines that start with `#' outside of a
+    body are comments.
+
+    """
+
+    snippets = {}
+    keyword = None
+    body = []
+    # The comment at the end finishes the last snippet
+    for lnum, line in enumerate(list(lines) + ['#'], 1):
+        line = line.rstrip('\r\n')
+        if keyword is not None and (not line.strip() or line[0] in ' \t'):
+            body.append(line)
+            continue
+
+        if keyword is not None:
+            while body and not body[-1].strip():
+                body.pop()
+            snippets[keyword] = "\n".join(l.lstrip(' \t') for l in body)
+            keyword = None
+
+        m = SNIPPET_PAT.match(line)
+        if m:
+            keyword = m.group(1)
+            body = []
+        elif line.strip() and not line.startswith('#'):
+            logging.debug("TeX-9: Ignoring line {0} of a snippet file: {1}".format(lnum, line))
+    return snippets
+
+def snippet_files(dirs, ft):
+    """Returns the snippet files of the filetype `ft' in the directories
+    `dirs': `ft.snippets' and the files in the subdirectory `ft' that
+    end with `.snippets', in this order."""
+
+    files = []
+    for d in dirs:
+        d = path.expanduser(d)
+        files.append(path.join(d, ft+'.snippets'))
+        subdir = path.join(d, ft)
+        if path.isdir(subdir):
+            files += [path.join(subdir, f) for f in sorted(os.listdir(subdir))
+                      if f.endswith('.snippets')]
+    return [f for f in files if path.isfile(f)]
+
+class TeXNineSnippetStore(object):
+    """Compiled snippet tables.
+
+    table() returns the snippets of a filetype from a list of files where
+    later files override the snippets of earlier ones. The table is
+    compiled from the files on first use and compiled again when the
+    list of files or the stamp (mtime, size) of one of them changes. The
+    tables are saved in `cache', a TeXNineCache or None, so that a new
+    Vim session does not need to compile them again.
+
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._tables = None
+
+    def _stamps(self, files):
+        stamps = []
+        for fname in files:
+            try:
+                st = os.stat(fname)
+                stamps.append((fname, st.st_mtime, st.st_size))
+            except OSError:
+                pass
+        return stamps
+
+    def table(self, ft, files):
+        """Returns the snippets of the filetype `ft' as a dictionary."""
+
+        if self._tables is None:
+            self._tables = (self.cache.load() if self.cache else None) or {}
+
+        stamps = self._stamps(files)
+        record = self._tables.get(ft)
+        if record is not None and record[0] == stamps:
+            return record[1]
+
+        table = {}
+        for fname, mtime, size in stamps:
+            logging.debug("TeX-9: Compiling snippets from `{0}'".format(path.basename(fname)))
+            try:
+                with open(fname) as f:
+                    table.update(parse_snippets(f.read().splitlines()))
+            except IOError, e:
+                logging.debug("TeX-9: Cannot read `{0}': {1}".format(fname, e))
+        self._tables[ft] = (stamps, table)
+        if self.cache:
+            self.cache.save(self._tables)
+        return table
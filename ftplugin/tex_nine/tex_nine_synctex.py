@@ -5,6 +5,27 @@ import dbus.mainloop.glib
 import vim
 import time
 
+def path_to_uri(fname):
+    return "file://" + pathname2url(fname)
+
+# One proxy per output file, keyed on its URI, so that the signal
+# receivers of the proxies do not pile up on the session bus
+proxies = {}
+
+def get_proxy(target, logger = None):
+    """Returns the proxy of the Evince window that shows `target',
+    creating it on first use."""
+    uri = path_to_uri(target)
+    if uri not in proxies:
+        proxies[uri] = TeXNineSyncTeX(target, logger)
+    return proxies[uri]
+
+def release_proxy(proxy):
+    """Forgets `proxy' and removes its signal receivers from the bus."""
+    if proxies.get(proxy.uri) is proxy:
+        del proxies[proxy.uri]
+    proxy.close()
+
 class TeXNineSyncTeX(evince_dbus.EvinceWindowProxy):
     def __init__(self, target, logger = None):
 
@@ -32,9 +53,7 @@ class TeXNineSyncTeX(evince_dbus.EvinceWindowProxy):
             vim.command('exe "normal" "\\<Esc>V"')
 
     def _path_to_uri(self, fname):
-        uri = "file://"
-        uri += pathname2url(fname)
-        return uri
+        return path_to_uri(fname)
 
     def _uri_to_path(self, uri, enc='latin1'):
         uri = uri[len('file://'):]
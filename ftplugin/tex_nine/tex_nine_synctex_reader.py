@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNineSyncTeXReader that reads the SyncTeX file written by
+# LaTeX (.synctex.gz or .synctex) and answers forward searches (source
+# line -> page and position) and backward searches (page and position
+# -> source line) without a PDF viewer. The file is read again only
+# when it changes, i.e. once per build. Does not depend on Vim.
+
+import re
+import os
+import os.path as path
+import gzip
+import logging
+from bisect import bisect_left
+
+# [tag,line(,column):h,v:W,H,D and the like; W, H and D are missing from
+# some records
+RECORD_PAT = re.compile(r'^([\[(vhxkg$])(\d+),(\d+)(?:,-?\d+)?:(-?\d+),(-?\d+)'
+                        r'(?::(-?\d+)(?:,(-?\d+),(-?\d+))?)?')
+INPUT_PAT = re.compile(r'^Input:(\d+):(.*)$')
+
+# Scaled points per big point
+SP_PER_BP = 65536*72.27/72
+
+class TeXNineSyncTeXReader(object):
+    """Index of a SyncTeX file.
+
+    `output' is the PDF file; the SyncTeX file is looked up next to it.
+    Positions are given in big points (1/72 inch) from the top left
+    corner of the page and pages are numbered from 1.
+
+    For every line of every input file the index keeps the first box
+    where the line appears; lines without boxes take the position of the
+    next line that has one. For every page it keeps the horizontal boxes
+    and the other nodes that SyncTeX records, to find the box under a
+    position.
+
+    """
+
+    def __init__(self, output):
+        base = path.splitext(output)[0]
+        self.candidates = [base+'.synctex.gz', base+'.synctex']
+        self.filename = None
+        self._stamp = None
+        self._reset()
+
+    def _reset(self):
+        self.inputs = {}
+        self._unit = 1.0
+        self._xoffset = 0
+        self._yoffset = 0
+        self._lines = {}
+        self._sorted = {}
+        self._boxes = {}
+        self._points = {}
+
+    def refresh(self):
+        """Reads the SyncTeX file if it changed. Raises IOError if it
+        does not exist."""
+
+        for fname in self.candidates:
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            stamp = (fname, st.st_mtime, st.st_size)
+            if stamp != self._stamp:
+                self._read(fname)
+                self._stamp = stamp
+            return
+        raise IOError("No SyncTeX file for `{0}'".format(self.candidates[0]))
+
+    def _read(self, fname):
+        logging.debug("TeX-9: Reading `{0}'".format(path.basename(fname)))
+        self._reset()
+        self.filename = fname
+        dirname = path.dirname(fname)
+        opener = gzip.open if fname.endswith('.gz') else open
+        magnification = 1000.0
+        unit = 1.0
+        page = 0
+        with opener(fname, 'rb') as f:
+            for line in f:
+                kind = line[:1]
+                if kind in '[(vhxkg$':
+                    m = RECORD_PAT.match(line)
+                    if m is None or not page:
+                        continue
+                    tag, lnum = int(m.group(2)), int(m.group(3))
+                    h, v = int(m.group(4)), int(m.group(5))
+                    if kind in '(h':
+                        width, height, depth = [int(g or 0) for g in m.group(6, 7, 8)]
+                        self._boxes.setdefault(page, []).append(
+                            (tag, lnum, h, v, width, height, depth))
+                    elif kind in 'xkg$':
+                        self._points.setdefault(page, []).append((tag, lnum, h, v))
+                    else:
+                        continue
+                    lines = self._lines.setdefault(tag, {})
+                    if lnum not in lines:
+                        lines[lnum] = (page, h, v - (height if kind in '(h' else 0))
+                elif kind == '{':
+                    page = int(line[1:])
+                elif kind == 'I':
+                    m = INPUT_PAT.match(line.rstrip('\r\n'))
+                    if m:
+                        self.inputs[int(m.group(1))] = path.normpath(
+                            path.join(dirname, m.group(2)))
+                elif line.startswith('Magnification:'):
+                    magnification = float(line.split(':')[1])
+                elif line.startswith('Unit:'):
+                    unit = float(line.split(':')[1])
+                elif line.startswith('X Offset:'):
+                    self._xoffset = int(line.split(':')[1])
+                elif line.startswith('Y Offset:'):
+                    self._yoffset = int(line.split(':')[1])
+
+        self._unit = unit*magnification/1000
+        self._sorted = dict((tag, sorted(lines)) for tag, lines in self._lines.items())
+        logging.debug("TeX-9: Indexed {0} page(s) of {1} input file(s)".format(
+            len(self._boxes), len(self.inputs)))
+
+    def _to_bp(self, h, v):
+        return ((h*self._unit + self._xoffset)/SP_PER_BP,
+                (v*self._unit + self._yoffset)/SP_PER_BP)
+
+    def _from_bp(self, x, y):
+        return ((x*SP_PER_BP - self._xoffset)/self._unit,
+                (y*SP_PER_BP - self._yoffset)/self._unit)
+
+    def forward(self, fname, line):
+        """Returns the 3-tuple (page, x, y) where `line' of `fname'
+        appears or None."""
+
+        self.refresh()
+        fname = path.normpath(fname)
+        for tag, name in self.inputs.items():
+            if name != fname or tag not in self._lines:
+                continue
+            lines = self._sorted[tag]
+            i = bisect_left(lines, line)
+            if i == len(lines):
+                i -= 1
+            page, h, v = self._lines[tag][lines[i]]
+            return (page,) + self._to_bp(h, v)
+        return None
+
+    def backward(self, page, x=0, y=0):
+        """Returns the 2-tuple (filename, line) of the source at the
+        position (`x', `y') on `page' or None.
+
+        The smallest box that contains the position wins. If there is
+        none, the node closest to the position is taken.
+        """
+
+        self.refresh()
+        h, v = self._from_bp(x, y)
+        found = [(width*(height+depth), tag, lnum)
+                 for tag, lnum, bh, bv, width, height, depth in self._boxes.get(page, [])
+                 if bh <= h <= bh+width and bv-height <= v <= bv+depth]
+        if found:
+            tag, lnum = min(found)[1:]
+        else:
+            nodes = [(tag, lnum, bh, bv) for tag, lnum, bh, bv, w, ht, d
+                     in self._boxes.get(page, [])] + self._points.get(page, [])
+            if not nodes:
+                return None
+            tag, lnum = min((abs(bv-v), abs(bh-h), tag, lnum)
+                            for tag, lnum, bh, bv in nodes)[2:]
+        if tag not in self.inputs:
+            return None
+        return (self.inputs[tag], lnum)
@@ -21,8 +21,10 @@
 #************************************************************************
 
 import re
+import os
 import vim
 import sys
+from bisect import bisect_left, bisect_right
 
 # Utility functions
 
@@ -32,6 +34,55 @@ def echoerr(errorstr):
 def echomsg(msgstr):
     sys.stdout.write("TeX-9: {0}\n".format(str(msgstr)))
 
+def parse_environments(lines, pat=re.compile(r'^\s*\\(begin|end){([^}]+)}')):
+    """Finds the LaTeX environments in `lines' in one pass.
+
+    Returns a 4-tuple of lists (begins, ends, names, parents) sorted by
+    the beginning line. Line numbers start from 1. The parent of an
+    environment is the index of the enclosing environment or -1.
+    Environments that are never closed get the ending line 0 and are
+    considered to extend up to the line before the end of their parent.
+
+    """
+
+    begins, ends, names, parents = [], [], [], []
+    stack = []
+    for row, line in enumerate(lines, 1):
+        if '\\' not in line:
+            continue
+        m = pat.match(line)
+        if not m:
+            continue
+        kind, name = m.groups()
+        if kind == 'begin':
+            parents.append(stack[-1] if stack else -1)
+            begins.append(row)
+            ends.append(0)
+            names.append(name)
+            stack.append(len(begins) - 1)
+        elif any(names[i] == name for i in stack):
+            # Environments left open inside this one are closed here
+            while names[stack[-1]] != name:
+                stack.pop()
+            ends[stack.pop()] = row
+
+    return (begins, ends, names, parents)
+
+_environments = {}
+
+def get_environments(vimbuffer):
+    """Returns parse_environments() of `vimbuffer'.
+
+    The result is cached per buffer and recomputed only when
+    b:changedtick changes.
+    """
+    tick = vim.eval('getbufvar({0}, "changedtick")'.format(vimbuffer.number))
+    cached = _environments.get(vimbuffer.number)
+    if cached is None or cached[0] != tick:
+        cached = (tick, parse_environments(vimbuffer))
+        _environments[vimbuffer.number] = cached
+    return cached[1]
+
 def get_latex_environment(vim_window):
     """Get information about the current LaTeX environment.
 
@@ -39,59 +90,29 @@ def get_latex_environment(vim_window):
     'environment': the name of the current LaTeX environment
     'range': 2-tuple of the beginning and ending line numbers 
 
+    The ending line number is 0 if the environment is not closed.
+
     """
 
-    pat = re.compile(r'^\s*\\(begin|end){([^}]+)}')
-    b = list(vim_window.buffer)
-    row = vim_window.cursor[0] - 1
-    environment = ""
-    begin = end = 0
-
-    current_line = b[row]
-    head = b[row - 1::-1] # From line above to the start
-    tail = b[row + 1:] # From next line to the end
-
-    c = pat.match(current_line)
-    if c:
-        environment = c.group(2)
-        if c.group(1) == 'end':
-            end = row + 1
-        elif c.group(1) == 'begin':
-            begin = row + 1
-
-    if not begin:
-        envs = {}
-        for i, line in enumerate(head):
-            m = pat.match(line)
-            if m:
-                e = m.group(2)
-                envs[m.groups()] = i
-                if ('begin', e) in envs and ('end', e) in envs and envs[('end', e)] < envs[('begin', e)]:
-                    # Eliminate nested environments
-                    del envs[('begin', e)]
-                    del envs[('end', e)]
-                elif ('end', e) not in envs:
-                    begin = row - i
-                    environment = e
-                    break
-
-    if not end:
-        envs = {}
-        for i, line in enumerate(tail):
-            m = pat.match(line)
-            if m:
-                envs[m.groups()] = i
-                e = m.group(2)
-                if ('begin', e) in envs and ('end', e) in envs: 
-                    #and envs[('end', e)] > envs[('begin', e)]:
-                    # Eliminate nested environments
-                    del envs[('begin', e)]
-                    del envs[('end', e)]
-                elif m.groups() == ('end', environment):
-                    end = row + i + 2
-                    break
-
-    return {'environment': environment, 'range': (begin, end)}
+    begins, ends, names, parents = get_environments(vim_window.buffer)
+    row = vim_window.cursor[0]
+
+    # The innermost environment that contains `row' is either the last
+    # one that begins before `row' or one of its ancestors.
+    i = bisect_right(begins, row) - 1
+    while i >= 0:
+        end = ends[i]
+        if not end:
+            # Unclosed environment: extends up to its parent's end
+            p = parents[i]
+            while p >= 0 and not ends[p]:
+                p = parents[p]
+            end = ends[p] - 1 if p >= 0 else row
+        if end >= row:
+            return {'environment': names[i], 'range': (begins[i], ends[i])}
+        i = parents[i]
+
+    return {'environment': "", 'range': (0, 0)}
 
 def is_latex_math_environment(vim_window,
                               environments = re.compile(r"matrix|cases|math|equation|align|array")):
@@ -99,6 +120,20 @@ def is_latex_math_environment(vim_window,
     e = get_latex_environment(vim_window)
     return  bool(environments.search(e['environment']))
 
+def path_stamp(paths):
+    """Returns a tuple of (path, mtime) pairs for the existing `paths'.
+
+    The tuple changes whenever one of the paths is created, removed or
+    modified, which makes it a cheap cache key.
+    """
+    stamp = []
+    for p in paths:
+        try:
+            stamp.append((p, os.stat(p).st_mtime))
+        except OSError:
+            pass
+    return tuple(stamp)
+
 def find_compiler(vimbuffer, nlines=10):
     """Finds the compiler from the header."""
     lines = "\n".join(vimbuffer[:nlines])
@@ -113,5 +148,74 @@ def find_compiler(vimbuffer, nlines=10):
         #Cannot determine the compiler
         return ""
 
+class TeXNineSymbolIndex(object):
+    """Sorted index of maths symbols for completion.
+
+    `tables' is a list of symbol tables, i.e. lists of Vim completion
+    items (dictionaries with at least the key 'word'). Later tables
+    override symbols of earlier ones with the same word.
+
+    """
+
+    def __init__(self, *tables):
+        symbols = {}
+        for table in tables:
+            for item in table:
+                symbols[item['word']] = item
+        self._words = sorted(symbols)
+        self._items = [symbols[w] for w in self._words]
+
+    def complete(self, base, fuzzy=False):
+        """Returns the symbols that start with `base'.
+
+        If `fuzzy' is True, symbols that contain the characters of
+        `base' in the same order are appended to the prefix matches.
+        """
+
+        i = bisect_left(self._words, base)
+        j = i
+        while j < len(self._words) and self._words[j].startswith(base):
+            j += 1
+        matches = self._items[i:j]
+
+        if fuzzy and base:
+            pat = re.compile('.*?'.join(map(re.escape, base)))
+            matches += [item for k, item in enumerate(self._items)
+                        if not i <= k < j and pat.search(self._words[k])]
+        return matches
+
+class TeXNineWordIndex(object):
+    """Sorted index of words for completion, e.g. environment names.
+
+    The words come from several sources that are set with update(). The
+    sources are merged again only when one of them changes.
+
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._words = []
+
+    def __contains__(self, source):
+        return source in self._sources
+
+    def update(self, source, words):
+        """Sets the words of `source'."""
+        words = list(words)
+        if self._sources.get(source) != words:
+            self._sources[source] = words
+            merged = set([])
+            for w in self._sources.values():
+                merged.update(w)
+            self._words = sorted(merged)
+
+    def complete(self, base):
+        """Returns the words that start with `base'."""
+        i = bisect_left(self._words, base)
+        j = i
+        while j < len(self._words) and self._words[j].startswith(base):
+            j += 1
+        return self._words[i:j]
+
 class TeXNineError(Exception):
     pass
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#************************************************************************
+#
+#                     TeX-9 library: Python module
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#    Copyright Elias Toivanen, 2011-2014
+#
+#************************************************************************
+
+# Short summary of the module:
+#
+# Defines TeXNineWorker that runs indexing jobs in a background thread.
+# Vim's Python interface is not thread-safe, so jobs must not touch the
+# vim module: gather everything a job needs on the main thread and let
+# the job work on plain Python data. Results are handed back to the
+# main thread through a lock-protected dictionary. TeXNineLogHandler
+# keeps the log messages of the jobs until the main thread can write
+# them.
+
+import threading
+import logging
+import Queue
+from collections import deque
+
+class TeXNineLogHandler(logging.StreamHandler):
+    """A log handler that writes to `stream' only from the thread that
+    created it, Vim's main thread.
+
+    Records logged in other threads are held back and written before the
+    next record of the main thread or when flush_pending() is called.
+
+    """
+
+    def __init__(self, stream=None):
+        logging.StreamHandler.__init__(self, stream)
+        self._thread = threading.current_thread()
+        self._pending = deque()
+
+    def emit(self, record):
+        if threading.current_thread() is not self._thread:
+            self._pending.append(record)
+            return
+        self.flush_pending()
+        logging.StreamHandler.emit(self, record)
+
+    def flush_pending(self):
+        if threading.current_thread() is not self._thread:
+            return
+        while self._pending:
+            logging.StreamHandler.emit(self, self._pending.popleft())
+
+def flush_log():
+    """Writes the held back records of the background jobs."""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, TeXNineLogHandler):
+            handler.flush_pending()
+
+class TeXNineWorker(object):
+    """A single background thread that runs named jobs.
+
+    A job is a callable identified by a name, e.g. 'labels'. Submitting
+    a job while another job with the same name is still waiting in the
+    queue replaces the waiting one. The result of the latest finished
+    job of every name is kept.
+
+    If `threaded' is False, jobs are run immediately in the calling
+    thread.
+
+    """
+
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._results = {}
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name='tex_nine_worker')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            name = self._queue.get()
+            with self._lock:
+                func, done = self._pending.pop(name)
+            try:
+                result = (func(), None)
+            except Exception, e:
+                logging.debug("TeX-9: Background job `{0}' failed: {1}".format(name, e))
+                result = (None, e)
+            with self._lock:
+                self._results[name] = result
+            done.set()
+
+    def submit(self, name, func):
+        """Queues a job and returns a threading.Event that is set when
+        the job is done."""
+
+        if not self.threaded:
+            done = threading.Event()
+            try:
+                result = (func(), None)
+            except Exception, e:
+                result = (None, e)
+            self._results[name] = result
+            done.set()
+            return done
+
+        with self._lock:
+            job = self._pending.get(name)
+            if job is None:
+                job = self._pending[name] = [func, threading.Event()]
+                self._queue.put(name)
+            else:
+                job[0] = func
+        self._start()
+        return job[1]
+
+    def result(self, name, default=None):
+        """Returns the result of the latest finished job `name'.
+
+        If the job raised an exception, the exception is raised here
+        once.
+        """
+
+        flush_log()
+        with self._lock:
+            value, error = self._results.get(name, (default, None))
+            if error is not None:
+                self._results[name] = (default, None)
+        if error is not None:
+            raise error
+        return value
+
+    def call(self, name, func, budget=None, default=None):
+        """Runs a job and waits for it at most `budget' seconds.
+
+        Returns the result of the job if it finished in time. Otherwise
+        returns the result of the previous job with the same name, or
+        `default' if there is none. Waits until the job is done if
+        `budget' is None.
+
+        """
+
+        done = self.submit(name, func)
+        done.wait(budget)
+        if not done.is_set():
+            logging.debug("TeX-9: Background job `{0}' is still running".format(name))
+        return self.result(name, default)